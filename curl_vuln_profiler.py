@@ -8,6 +8,7 @@ import multiprocessing
 import statistics
 import time
 import shutil
+import tempfile
 
 # --- CONFIGURATION ---
 PROJECT_NAME = "curl"
@@ -123,11 +124,15 @@ def parse_perf_output(output):
     return results
 
 def profile_test(test_id, n_loops, log_file):
-    perf_cmd = (
-        "perf stat -x, -a -e "
-        "power/energy-pkg/,power/energy-cores/,cycles,instructions "
-        f"sh -c 'for i in $(seq 1 {n_loops}); do ./runtests.pl -q {test_id} > /dev/null 2>&1; done'"
-    )
+    # perf repeats the test itself (-r) and reports per-run means, so no shell loop.
+    # Counts go to their own file (-o) so runtests' stderr never mixes into the CSV.
+    fd, perf_out = tempfile.mkstemp(prefix="perf_", suffix=".csv")
+    os.close(fd)
+    perf_cmd = [
+        "perf", "stat", "-r", str(n_loops), "-x,", "-o", perf_out, "-a", "-e",
+        "power/energy-pkg/,power/energy-cores/,cycles,instructions",
+        "./runtests.pl", "-q", test_id
+    ]
     test_dir = os.path.join(PROJECT_PATH, "tests")
     
     measurements = {
@@ -136,18 +141,23 @@ def profile_test(test_id, n_loops, log_file):
     
     write_log(f"⚡ Profiling Test {test_id} (Loops: {n_loops}, Repetitions: {OUTER_LOOP_COUNT})...", log_file)
     
-    for i in range(OUTER_LOOP_COUNT):
-        proc = subprocess.run(
-            perf_cmd, shell=True, cwd=test_dir, 
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
-        data = parse_perf_output(proc.stderr)
-        
-        if n_loops > 0:
-            measurements["energy_pkg"].append(data["energy_pkg"] / n_loops)
-            measurements["energy_core"].append(data["energy_core"] / n_loops)
-            measurements["instructions"].append(data["instructions"] / n_loops)
-            measurements["cycles"].append(data["cycles"] / n_loops)
+    try:
+        for i in range(OUTER_LOOP_COUNT):
+            subprocess.run(
+                perf_cmd, cwd=test_dir, 
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            # Emptied after reading so a perf that fails to start yields zeros, not the last run
+            with open(perf_out, "r+") as f:
+                data = parse_perf_output(f.read())
+                f.truncate(0)
+            
+            measurements["energy_pkg"].append(data["energy_pkg"])
+            measurements["energy_core"].append(data["energy_core"])
+            measurements["instructions"].append(data["instructions"])
+            measurements["cycles"].append(data["cycles"])
+    finally:
+        os.remove(perf_out)
 
     final_stats = {}
     for key, values in measurements.items():
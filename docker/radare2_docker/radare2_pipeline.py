@@ -3,11 +3,16 @@ import subprocess
 import csv
 import logging
 import json
+import hashlib
 import time
 import sys
 import urllib.request
 import re
-import shlex
+import math
+import tempfile
+import threading
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 import yaml
 
 # [KEEP] Project-Independent Helpers (Exact Copy)
@@ -55,15 +60,24 @@ PROJECT_DIR = os.path.join(INPUT_DIR, REPO_NAME)
 LOG_DIR = os.path.join(OUTPUT_DIR, "log")
 CACHE_DIR = os.path.join(LOG_DIR, "cache")
 GCDA_DIR = os.path.join(OUTPUT_DIR, "gcda_files")
+CCACHE_DIR = os.path.join(CACHE_DIR, "ccache")
 
 ITERATIONS = 5
 DEFAULT_TIMEOUT_MS = 2000
 COOL_DOWN_TO_SEC = 1.0
+COOL_DOWN_POWER_W = 5.0
+RAPL_ENERGY_FILE = "/sys/class/powercap/intel-rapl:0/energy_uj"
+# Cores the workload (warm-up and measured loop) is pinned to. perf itself
+# stays system-wide (-a): the RAPL package event is per package, not per CPU.
+MEASURE_CPUS = os.environ.get("MEASURE_CPUS", "2-3")
 
 ENERGY_RE = re.compile(r'\bpower/energy-[^/\s]+/?\b')
 
+# Shared by every run_command call instead of copying os.environ each time.
+_ENV = {**os.environ, "LC_ALL": "C", "CCACHE_DIR": CCACHE_DIR}
+
 def prepare_directories():
-    for d in [INPUT_DIR, OUTPUT_DIR, LOG_DIR, CACHE_DIR, GCDA_DIR]:
+    for d in [INPUT_DIR, OUTPUT_DIR, LOG_DIR, CACHE_DIR, GCDA_DIR, CCACHE_DIR]:
         if not os.path.exists(d): os.makedirs(d)
 
 def setup_logging():
@@ -72,12 +86,13 @@ def setup_logging():
 
 def run_command(command, cwd, ignore_errors=False):
     try:
-        env = os.environ.copy()
-        env["LC_ALL"] = "C"
-        result = subprocess.run(command, cwd=cwd, shell=True, env=env,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        # Static argv lists skip the /bin/sh fork.
+        # stdout is discarded and stderr is kept raw for the failure log only.
+        result = subprocess.run(command, cwd=cwd, shell=isinstance(command, str), env=_ENV,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
         if result.returncode != 0 and not ignore_errors:
-            logging.error(f"FAIL: {command}\nSTDERR: {result.stderr.strip()}")
+            stderr = result.stderr.decode(errors="replace")
+            logging.error(f"FAIL: {command}\nSTDERR: {stderr.strip()}")
             return False
         return True
     except Exception as e:
@@ -97,8 +112,8 @@ def load_json(filepath):
     return {}
 
 def clean_repo(cwd):
-    run_command("git reset --hard", cwd)
-    run_command("git clean -fdx", cwd)
+    run_command(["git", "reset", "--hard"], cwd)
+    run_command(["git", "clean", "-fdx"], cwd)
 
 def download_csv_if_missing():
     if not os.path.exists(INPUT_CSV):
@@ -115,16 +130,33 @@ def get_git_diff_files(cwd, commit_hash):
     result = subprocess.run(cmd, cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
     return {f for f in result.stdout.strip().split('\n') if f}
 
+def get_coverage_cache_path(cwd, vuln, fix):
+    # Keyed on the patch content rather than the SHAs so rebased pairs still hit.
+    try:
+        diff = subprocess.check_output(["git", "diff", "--no-color", vuln, fix], cwd=cwd)
+    except Exception as e:
+        logging.error(f"Failed to hash diff for cache: {e}")
+        return None
+    key = hashlib.sha256(diff).hexdigest()
+    return os.path.join(CACHE_DIR, f"cov_{key}.json")
+
+def _scan_gcda(root):
+    # scandir exposes the entry type without an extra stat per file.
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(e.path)
+                    elif e.name.endswith(".gcda"):
+                        yield e.path
+        except OSError:
+            continue
+
 def get_covered_files(cwd):
-    covered = set()
-    for root, dirs, files in os.walk(cwd):
-        for file in files:
-            if file.endswith(".gcda"):
-                source_name = file.replace(".gcda", ".c")
-                rel_dir = os.path.relpath(root, cwd)
-                full_path = source_name if rel_dir == "." else os.path.join(rel_dir, source_name)
-                covered.add(full_path)
-    return list(covered)
+    return list({os.path.relpath(p, cwd).replace(".gcda", ".c") for p in _scan_gcda(cwd)})
 
 def flush_buffer_to_csv(filepath, buffer, fieldnames):
     if not buffer: return
@@ -157,12 +189,17 @@ def configure_radare2(cwd, coverage=False):
         flags += " --coverage"
         libs = "-lgcov" # [FIX] Link gcov
     
-    full_cmd = f'CFLAGS="{flags}" LDFLAGS="{flags}" LIBS="{libs}" {" ".join(config_args)}'
+    # Coverage and plain objects hash differently, so one persistent ccache
+    # holds both variants and the Phase 2 rebuild after `make clean` is cheap.
+    cc = 'CC="ccache gcc" ' if shutil.which("ccache") else ""
+    full_cmd = f'{cc}CFLAGS="{flags}" LDFLAGS="{flags}" LIBS="{libs}" {" ".join(config_args)}'
     
     return run_command(full_cmd, cwd)
 
-def build_radare2(cwd):
-    if not run_command("make -j$(nproc)", cwd):
+def build_radare2(cwd, jobs=None):
+    # Defaults to every CPU this process may use, like $(nproc)
+    jobs = jobs or len(os.sched_getaffinity(0))
+    if not run_command(["make", f"-j{jobs}"], cwd):
         logging.error("Make failed.")
         return False
         
@@ -187,25 +224,36 @@ def get_radare2_tests(cwd):
 # PHASE 1 & 2 LOGIC
 # ==========================================
 
-def process_commit(commit: str, coverage: bool = True) -> (dict | None):
-    logging.info(f"Building {commit[:8]} (Coverage)...")
-    clean_repo(PROJECT_DIR)
-    run_command(f"git checkout -f {commit}", PROJECT_DIR)
-    
+def checkout_commit(commit, cwd):
+    clean_repo(cwd)
+    if not run_command(["git", "checkout", "-f", commit], cwd):
+        logging.error(f"Failed to checkout {commit}")
+        return False
+
     # [FIX] Initialize submodules so old Makefiles don't crash
-    run_command("git submodule update --init --recursive", PROJECT_DIR)
+    # Fetch submodules in parallel and shallow; only the pinned tree is needed.
+    run_command("git -c submodule.fetchJobs=$(nproc) submodule update --init --recursive --jobs $(nproc) --depth 1", cwd)
+    return True
+
+def process_commit(commit: str, coverage: bool = True, cwd: str = PROJECT_DIR,
+                   jobs: int | None = None, progress: bool = True, stop=None) -> (dict | None):
+    # stop (a threading.Event) abandons the commit between steps once it is set
+    stopped = lambda: stop is not None and stop.is_set()
+    logging.info(f"Building {commit[:8]} (Coverage)...")
+    if not checkout_commit(commit, cwd) or stopped(): return None
     
     commit_results = { "hash": commit, "tests": [] }
 
-    if not configure_radare2(PROJECT_DIR, coverage=coverage): return None
-    if not build_radare2(PROJECT_DIR): return None
+    if not configure_radare2(cwd, coverage=coverage) or stopped(): return None
+    if not build_radare2(cwd, jobs) or stopped(): return None
     
-    suite = get_radare2_tests(PROJECT_DIR)
-    print(f"\nRunning {len(suite)} tests...")
+    suite = get_radare2_tests(cwd)
+    print(f"\nRunning {len(suite)} tests on {commit[:8]}...")
 
-    pb = ProgressBar(len(suite), step=10)
+    pb = ProgressBar(len(suite), step=10) if progress else None
     for i, t in enumerate(suite):
-        pb.set(i)
+        if stopped(): return None
+        if pb: pb.set(i)
 
         test = {
             "name": t['name'],
@@ -214,28 +262,42 @@ def process_commit(commit: str, coverage: bool = True) -> (dict | None):
             "covered_files": []
         }
 
-        run_command("find . -name '*.gcda' -delete", PROJECT_DIR)
+        run_command("find . -name '*.gcda' -delete", cwd)
         
-        if not run_command(test.get('cmd'), PROJECT_DIR):
+        if not run_command(test.get('cmd'), cwd):
             logging.warning(f"Test Build/Run Failed: {test.get('name')}")
             test['failed'] = True
             commit_results['tests'].append(test)
             continue
         
-        covered = get_covered_files(PROJECT_DIR)
+        covered = get_covered_files(cwd)
         test['covered_files'] = covered
         commit_results['tests'].append(test)
         
     return commit_results
 
-def prepare_for_energy_measurement():
+def has_passing_tests(commit_results):
+    return bool(commit_results) and not all(t.get('failed', True) for t in commit_results.get('tests', []))
+
+def select_tests_for_measurement(tests):
+    passed = [t for t in tests if not t.get('failed', True)]
+    if not os.environ.get("PR_MODE"):
+        return passed
+
+    # Only-changes mode: measure tests whose coverage hits a changed file
+    # ('keep', set by extract_test_covering_git_changes). Tests without
+    # coverage data are kept as a conservative fallback.
+    return [t for t in passed if t.get('keep', True) or not t.get('covered_files')]
+
+def prepare_for_energy_measurement(cwd=PROJECT_DIR):
     print("\nPreparing project for energy measurement...")
     
     # [FIX] Clean build to prevent linking errors in Phase 2
-    run_command("make clean", PROJECT_DIR)
+    # (a fresh checkout reusing cached coverage has nothing to clean)
+    run_command("make clean", cwd, ignore_errors=True)
     
-    configure_radare2(PROJECT_DIR, coverage=False)
-    build_radare2(PROJECT_DIR)
+    configure_radare2(cwd, coverage=False)
+    build_radare2(cwd)
     
 def run_phase_1_coverage(vuln, fix):
     logging.info(f"--- Phase 1: Coverage {vuln[:8]} -> {fix[:8]} ---")
@@ -255,86 +317,136 @@ def run_phase_1_coverage(vuln, fix):
     if not git_changed_files:
         logging.error("No target files found in git diff.")
         return None
+
+    # Coverage depends only on the patch, so a hit skips the coverage builds;
+    # the energy runs below still happen for every pair.
+    cache_path = get_coverage_cache_path(PROJECT_DIR, vuln, fix)
+    cached = load_json(cache_path) if cache_path else None
     
-    # FIX COMMIT
-    coverage_results['fix_commit'] = process_commit(fix)
-    if not coverage_results['fix_commit'] or all(t.get('failed', True) for t in coverage_results['fix_commit'].get('tests', [])):
-        logging.error("No successful tests in fix commit. Skipping processing.")
+    # The two coverage builds share nothing but the checkout, so the fix
+    # commit gets its own worktree and both commits build side by side,
+    # each with half of the CPUs.
+    worktree_fix = tempfile.mkdtemp(prefix=f"{REPO_NAME}_fix_", dir=INPUT_DIR)
+    if not run_command(["git", "worktree", "add", "--detach", worktree_fix, fix], PROJECT_DIR):
+        logging.error(f"Failed to create worktree for fix commit: {fix}")
         return None
-    
-    extract_test_covering_git_changes(coverage_results.get('fix_commit', {}), git_changed_files)
-    logging.info(f"Extracted tests covering changed files in pair ({vuln[:8]}, {fix[:8]}).")
-    logging.info(f"Now computing energy for {fix[:8]}.")
-    
-    rapl_pkg = detect_rapl()
-    kept_tests = [t for t in coverage_results['fix_commit'].get('tests', []) if t.get('keep', True) and not t.get('failed', True)]
 
-    prepare_for_energy_measurement()
-    for test in kept_tests:
-        measure_test(rapl_pkg, test, fix)
+    measured = True
+    try:
+        if cached:
+            logging.info(f"Reusing P1 coverage for ({vuln[:8]}, {fix[:8]}) from cache: {cache_path}")
+            coverage_results = cached
+            coverage_results['fix_commit']['hash'] = fix
+            coverage_results['vuln_commit']['hash'] = vuln
+            if not (checkout_commit(fix, worktree_fix) and checkout_commit(vuln, PROJECT_DIR)):
+                return None
+        else:
+            jobs = max(1, len(os.sched_getaffinity(0)) // 2)
+            stop_vuln = threading.Event()
+            with ThreadPoolExecutor(max_workers=2) as ex:
+                fut_fix = ex.submit(process_commit, fix, True, worktree_fix, jobs)
+                # Only one progress bar, so the two threads do not interleave on stdout
+                fut_vuln = ex.submit(process_commit, vuln, True, PROJECT_DIR, jobs, False, stop_vuln)
+                coverage_results['fix_commit'] = fut_fix.result()
+                # Without a passing fix test the pair is skipped, so the vuln build can stop early
+                if not has_passing_tests(coverage_results['fix_commit']):
+                    stop_vuln.set()
+                coverage_results['vuln_commit'] = fut_vuln.result()
+
+        # FIX COMMIT
+        if not has_passing_tests(coverage_results['fix_commit']):
+            logging.error("No successful tests in fix commit. Skipping processing.")
+            return None
+        
+        extract_test_covering_git_changes(coverage_results.get('fix_commit', {}), git_changed_files)
+        logging.info(f"Extracted tests covering changed files in pair ({vuln[:8]}, {fix[:8]}).")
+        logging.info(f"Now computing energy for {fix[:8]}.")
+        
+        rapl_pkg = detect_rapl()
+        kept_tests = select_tests_for_measurement(coverage_results['fix_commit'].get('tests', []))
 
-    # VULN COMMIT
-    coverage_results['vuln_commit'] = process_commit(vuln)
-    if not coverage_results['vuln_commit'] or all(t.get('failed', True) for t in coverage_results['vuln_commit'].get('tests', [])):
-        logging.error("No successful tests in vuln commit. Skipping processing.")
-        return None
+        # Energy runs stay sequential so the two commits never share the CPU.
+        prepare_for_energy_measurement(worktree_fix)
+        for test in kept_tests:
+            measured &= measure_test(rapl_pkg, test, fix, worktree_fix)
 
-    extract_test_covering_git_changes(coverage_results.get('vuln_commit', {}), git_changed_files)
-    logging.info(f"Extracted tests covering changed files in pair ({vuln[:8]}, {fix[:8]}).")
-    logging.info(f"Now computing energy for {vuln[:8]}.")
-    
-    kept_tests = [t for t in coverage_results.get('vuln_commit', {}).get('tests', []) if t.get('keep', True) and not t.get('failed', True)]
-    
-    prepare_for_energy_measurement()
-    for test in kept_tests:
-        measure_test(rapl_pkg, test, vuln)
+        # VULN COMMIT
+        if not has_passing_tests(coverage_results['vuln_commit']):
+            logging.error("No successful tests in vuln commit. Skipping processing.")
+            return None
 
+        extract_test_covering_git_changes(coverage_results.get('vuln_commit', {}), git_changed_files)
+        logging.info(f"Extracted tests covering changed files in pair ({vuln[:8]}, {fix[:8]}).")
+        logging.info(f"Now computing energy for {vuln[:8]}.")
+        
+        kept_tests = select_tests_for_measurement(coverage_results.get('vuln_commit', {}).get('tests', []))
+        
+        prepare_for_energy_measurement(PROJECT_DIR)
+        for test in kept_tests:
+            measured &= measure_test(rapl_pkg, test, vuln, PROJECT_DIR)
+    finally:
+        run_command(["git", "worktree", "remove", "--force", worktree_fix], PROJECT_DIR)
+
+    # Only a fully measured pair is cached, so failed energy runs are retried
+    if cache_path and measured:
+        save_json(cache_path, coverage_results)
     return coverage_results
     
-def extract_test_covering_git_changes(coverage_results, target_files):  
-    for target in target_files:
-        for test in coverage_results.get('tests', []):
-            if coverage_results.get('failed', {}).get('status', True):
-                continue
-        
-            for test in coverage_results.get('tests', []):
-                covered_files = test.get('covered_files', [])
-                test['keep'] = target in covered_files
+def extract_test_covering_git_changes(coverage_results, target_files):
+    # Keep a test if it covers ANY changed file (previously only the last target counted).
+    targets = set(target_files)
+    if coverage_results.get('failed', {}).get('status', False):
+        return
+    for test in coverage_results.get('tests', []):
+        test['keep'] = not targets.isdisjoint(test.get('covered_files', ()))
 
 # ==========================================
 # PHASE 2: ENERGY (Exact Copy)
 # ==========================================
+_RAPL_EVENTS = None
+
 def detect_rapl(perf_bin="perf"):
+    # `perf list` is slow and its answer cannot change within a run.
+    global _RAPL_EVENTS
+    if _RAPL_EVENTS is None:
+        _RAPL_EVENTS = _detect_rapl_impl(perf_bin)
+    return _RAPL_EVENTS
+
+def _detect_rapl_impl(perf_bin="perf"):
     cmd = [perf_bin, "list", "--no-desc"]
     try:
         out = subprocess.check_output(cmd, text=True, stderr=subprocess.STDOUT)
     except subprocess.CalledProcessError:
         out = subprocess.check_output([perf_bin, "list"], text=True, stderr=subprocess.STDOUT)
 
-    events = set()
-    for line in out.splitlines():
-        for m in ENERGY_RE.findall(line):
-            if not m.endswith("/"): m += "/"
-            events.add(m)
+    events = {m if m.endswith("/") else m + "/" for m in ENERGY_RE.findall(out)}
     return sorted(events)
 
-def _wrap_until_timeout(test_cmd: str, timeout_ms: int) -> str:
-    timeout_s = max(1, int((timeout_ms + 999) / 1000))
-    wrapped = (
-        "bash -lc "
-        + shlex.quote(
-            f"""
-            set -e
-            end=$((SECONDS + {timeout_s}))
-            while [ $SECONDS -lt $end ]; do
-              {test_cmd}
-            done
-            """
-        )
-    )
-    return wrapped
-
-def measure_test(pkg_event, test, commit):
+def _read_energy_uj():
+    try:
+        with open(RAPL_ENERGY_FILE, 'r') as f: return int(f.read())
+    except (OSError, ValueError): return None
+
+def wait_cooldown(threshold_w=COOL_DOWN_POWER_W, max_s=COOL_DOWN_TO_SEC, window_s=0.1):
+    # Resume as soon as package power drops below the threshold; without
+    # readable powercap counters this degrades to the fixed sleep.
+    deadline = time.monotonic() + max_s
+    while time.monotonic() < deadline:
+        e0 = _read_energy_uj()
+        time.sleep(window_s)
+        e1 = _read_energy_uj()
+        if e0 is None or e1 is None:
+            time.sleep(max(0.0, deadline - time.monotonic()))
+            return
+        if e1 >= e0 and (e1 - e0) / window_s < threshold_w * 1e6:
+            return
+
+def _loop_command(test_cmd: str, iterations: int) -> str:
+    # Grouped so the redirect covers the whole command, not just the last
+    # part of e.g. `make -k unit || true`.
+    return f"for i in $(seq 1 {iterations}); do {{ {test_cmd}; }} >/dev/null 2>&1; done"
+
+def measure_test(pkg_event, test, commit, cwd=PROJECT_DIR):
     if isinstance(pkg_event, (list, tuple, set)):
         events = [str(e).strip() for e in pkg_event if str(e).strip()]
     elif pkg_event:
@@ -349,23 +461,41 @@ def measure_test(pkg_event, test, commit):
     os.makedirs(perf_dir, exist_ok=True)
 
     timeout_ms = test.get("timeout_ms", DEFAULT_TIMEOUT_MS)
-    print(f"\nMeasuring energy for test '{test.get('name')}': {ITERATIONS} iters")
+
+    # One warm-up run sizes a fixed loop that fills the timeout window.
+    start = time.time()
+    try:
+        subprocess.run(["taskset", "-c", MEASURE_CPUS, "sh", "-c", test["cmd"]], cwd=cwd,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout_ms / 1000)
+    except subprocess.TimeoutExpired:
+        logging.error(f"Warm-up of {test.get('name')} exceeded {timeout_ms}ms. Skipping test.")
+        return False
+    duration = max(time.time() - start, 0.001)
+    loop_iters = max(1, math.ceil(timeout_ms / 1000 / duration))
+    loop_cmd = _loop_command(test["cmd"], loop_iters)
+
+    # perf totals cover the whole loop; the divisor for per-run values is kept
+    # next to the CSVs so it survives without the coverage JSON.
+    save_json(os.path.join(perf_dir, f"{commit}_{test.get('name')}__loops.json"),
+              {"loop_iterations": loop_iters, "iterations": ITERATIONS})
+
+    print(f"\nMeasuring energy for test '{test.get('name')}': {ITERATIONS} iters x {loop_iters} runs")
 
     for iteration in range(ITERATIONS):
         pb.set(iteration)
         perf_out = os.path.join(perf_dir, f"{commit}_{test.get('name')}__{iteration}.csv")
-        wrapped_cmd = _wrap_until_timeout(test["cmd"], timeout_ms)
-        perf_argv = ["perf", "stat", "-a", "-e", f"{perf_events}", "-x,", "--output", perf_out, "--", "sh", "-c", wrapped_cmd]
+        perf_argv = ["perf", "stat", "-a", "-e", f"{perf_events}", "-x,", "--output", perf_out, "--",
+                     "taskset", "-c", MEASURE_CPUS, "sh", "-c", loop_cmd]
 
-        res = subprocess.run(perf_argv, cwd=PROJECT_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        res = subprocess.run(perf_argv, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
         
         if res.returncode != 0: 
             logging.error(f"[STD ERR] {test.get('name')}: {res.stderr}")
             if os.path.exists(perf_out): os.remove(perf_out)
-            return None
+            return False
         
-        time.sleep(COOL_DOWN_TO_SEC)
-    return None
+        wait_cooldown()
+    return True
 
 def read_configuration():
     config_file = os.path.join(BASE_DIR, "config.yaml")
@@ -0,0 +1,38 @@
+import os
+import unittest
+from unittest import mock
+
+import radare2_pipeline as pipeline
+
+
+class SelectTestsForMeasurementTest(unittest.TestCase):
+    TARGETS = ["libr/bin/format/elf/elf.c"]
+
+    def make_tests(self):
+        tests = [
+            {"name": "hits-target", "failed": False, "covered_files": ["libr/bin/format/elf/elf.c"]},
+            {"name": "misses-target", "failed": False, "covered_files": ["libr/util/str.c"]},
+            {"name": "no-coverage", "failed": False, "covered_files": []},
+            {"name": "failed", "failed": True, "covered_files": ["libr/bin/format/elf/elf.c"]},
+        ]
+        coverage_results = {"tests": tests}
+        pipeline.extract_test_covering_git_changes(coverage_results, self.TARGETS)
+        return tests
+
+    def names(self, tests):
+        return [t["name"] for t in tests]
+
+    def test_full_sweep_measures_every_passing_test(self):
+        with mock.patch.dict(os.environ, {}, clear=False):
+            os.environ.pop("PR_MODE", None)
+            selected = pipeline.select_tests_for_measurement(self.make_tests())
+        self.assertEqual(self.names(selected), ["hits-target", "misses-target", "no-coverage"])
+
+    def test_pr_mode_prunes_to_target_hits_and_tests_without_coverage(self):
+        with mock.patch.dict(os.environ, {"PR_MODE": "1"}):
+            selected = pipeline.select_tests_for_measurement(self.make_tests())
+        self.assertEqual(self.names(selected), ["hits-target", "no-coverage"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,6 +8,14 @@ import math
 import sys
 import urllib.request
 import glob
+import tempfile
+
+# Optional fast JSON for the checkpoint files.
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 # ==========================================
 # CONFIGURATION
@@ -15,7 +23,11 @@ import glob
 REPO_NAME = "tcpdump"
 TARGET_DURATION_SEC = 2.0
 CSV_WRITE_INTERVAL = 50
+CHECKPOINT_INTERVAL = 10
 TEST_LIMIT = None
+# Cores the workload (warm-up and measured loop) is pinned to. perf itself
+# stays system-wide (-a): the RAPL package event is per package, not per CPU.
+MEASURE_CPUS = os.environ.get("MEASURE_CPUS", "2-3")
 
 GIST_CSV_URL = "https://gist.githubusercontent.com/waheed-sep/935cfc1ba42b2475d45336a4c779cbc8/raw/ea91568360d87979373a7eca38f289c9bf30d103/cwe_projects.csv"
 
@@ -39,17 +51,21 @@ console = logging.StreamHandler()
 console.setLevel(logging.INFO)
 logging.getLogger('').addHandler(console)
 
+# Shared by every run_command call instead of copying os.environ each time.
+_ENV = {**os.environ, "LC_ALL": "C"}
+
 # ==========================================
 # HELPERS
 # ==========================================
 def run_command(command, cwd, ignore_errors=False):
     try:
-        env = os.environ.copy()
-        env["LC_ALL"] = "C"
-        result = subprocess.run(command, cwd=cwd, shell=True, env=env,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        # Static argv lists skip the /bin/sh fork.
+        # stdout is discarded and stderr is kept raw for the failure log only.
+        result = subprocess.run(command, cwd=cwd, shell=isinstance(command, str), env=_ENV,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
         if result.returncode != 0 and not ignore_errors:
-            logging.error(f"FAIL: {command}\nSTDERR: {result.stderr.strip()}")
+            stderr = result.stderr.decode(errors="replace")
+            logging.error(f"FAIL: {command}\nSTDERR: {stderr.strip()}")
             return False
         return True
     except Exception as e:
@@ -58,14 +74,21 @@ def run_command(command, cwd, ignore_errors=False):
 
 def save_json(filepath, data):
     try:
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=4)
+        if ORJSON_AVAILABLE:
+            with open(filepath, 'wb') as f:
+                f.write(orjson.dumps(data))
+        else:
+            with open(filepath, 'w') as f:
+                json.dump(data, f)
     except Exception as e:
         logging.error(f"JSON Save Error: {e}")
 
 def load_json(filepath):
     if os.path.exists(filepath):
         try:
+            if ORJSON_AVAILABLE:
+                with open(filepath, 'rb') as f:
+                    return orjson.loads(f.read())
             with open(filepath, 'r') as f:
                 return json.load(f)
         except:
@@ -73,8 +96,8 @@ def load_json(filepath):
     return {}
 
 def clean_repo(cwd):
-    run_command("git reset --hard", cwd)
-    run_command("git clean -fdx", cwd)
+    run_command(["git", "reset", "--hard"], cwd)
+    run_command(["git", "clean", "-fdx"], cwd)
 
 def download_csv_if_missing():
     if not os.path.exists(INPUT_CSV):
@@ -91,18 +114,23 @@ def get_git_diff_files(cwd, commit_hash):
     result = subprocess.run(cmd, cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
     return {f for f in result.stdout.strip().split('\n') if f}
 
+def _scan_gcda(root):
+    # scandir exposes the entry type without an extra stat per file.
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(e.path)
+                    elif e.name.endswith(".gcda"):
+                        yield e.path
+        except OSError:
+            continue
+
 def get_covered_files(cwd):
-    covered = set()
-    for root, dirs, files in os.walk(cwd):
-        for file in files:
-            if file.endswith(".gcda"):
-                source_name = file.replace(".gcda", ".c")
-                rel_dir = os.path.relpath(root, cwd)
-                full_path = source_name if rel_dir == "." else os.path.join(rel_dir, source_name)
-                if full_path.startswith("./"):
-                    full_path = full_path[2:]
-                covered.add(full_path)
-    return list(covered)
+    return list({os.path.relpath(p, cwd).replace(".gcda", ".c") for p in _scan_gcda(cwd)})
 
 def flush_buffer_to_csv(filepath, buffer, fieldnames):
     if not buffer: return
@@ -190,12 +218,19 @@ def get_tcpdump_tests(cwd):
 # ==========================================
 # PHASE 1: COVERAGE
 # ==========================================
-def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path):
+def load_seen_pairs(master_csv_path):
+    seen = set()
     if os.path.exists(master_csv_path):
-        with open(master_csv_path, 'r') as f:
-            if f"{vuln},{fix}" in f.read():
-                logging.info(f"Skipping P1 for {vuln}->{fix} (Found in Master CSV)")
-                return True
+        with open(master_csv_path, 'r', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            seen = {(r[1], r[3]) for r in reader if len(r) > 3}
+    return seen
+
+def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path, seen_pairs):
+    if (vuln, fix) in seen_pairs:
+        logging.info(f"Skipping P1 for {vuln}->{fix} (Found in Master CSV)")
+        return True
 
     logging.info(f"--- Phase 1: Coverage {vuln} -> {fix} ---")
     
@@ -216,7 +251,7 @@ def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path):
         clean_repo(PROJECT_DIR)
         run_command(f"git checkout -f {vuln}", PROJECT_DIR)
         
-        run_command("./configure CFLAGS='-fprofile-arcs -ftest-coverage -g -O0' LDFLAGS='-fprofile-arcs -ftest-coverage'", PROJECT_DIR)
+        run_command("./configure CFLAGS='-O2 -g -fprofile-arcs -ftest-coverage' LDFLAGS='-fprofile-arcs -ftest-coverage'", PROJECT_DIR)
         run_command("make clean", PROJECT_DIR)
         run_command("make -j$(nproc)", PROJECT_DIR)
         
@@ -237,7 +272,8 @@ def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path):
             
             if relevant:
                 vuln_results[t_name] = relevant
-                save_json(checkpoint_path, {"status": "IN_PROGRESS", "results": vuln_results})
+                if len(vuln_results) % CHECKPOINT_INTERVAL == 0:
+                    save_json(checkpoint_path, {"status": "IN_PROGRESS", "results": vuln_results})
         
         save_json(checkpoint_path, {"status": "COMPLETE", "results": vuln_results})
 
@@ -246,7 +282,7 @@ def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path):
     clean_repo(PROJECT_DIR)
     run_command(f"git checkout -f {fix}", PROJECT_DIR)
     
-    run_command("./configure CFLAGS='-fprofile-arcs -ftest-coverage -g -O0' LDFLAGS='-fprofile-arcs -ftest-coverage'", PROJECT_DIR)
+    run_command("./configure CFLAGS='-O2 -g -fprofile-arcs -ftest-coverage' LDFLAGS='-fprofile-arcs -ftest-coverage'", PROJECT_DIR)
     run_command("make clean", PROJECT_DIR)
     run_command("make -j$(nproc)", PROJECT_DIR)
 
@@ -277,12 +313,22 @@ def run_phase_1_coverage(vuln, fix, master_csv_path, checkpoint_path):
             flush_buffer_to_csv(master_csv_path, csv_buffer, csv_header)
 
     flush_buffer_to_csv(master_csv_path, csv_buffer, csv_header)
+    seen_pairs.add((vuln, fix))
     return True
 
 # ==========================================
 # PHASE 2: ENERGY
 # ==========================================
+_RAPL_EVENTS = None
+
 def detect_rapl():
+    # `perf list` is slow and its answer cannot change within a run.
+    global _RAPL_EVENTS
+    if _RAPL_EVENTS is None:
+        _RAPL_EVENTS = _detect_rapl_impl()
+    return _RAPL_EVENTS
+
+def _detect_rapl_impl():
     res = subprocess.run("perf list", shell=True, stdout=subprocess.PIPE, text=True)
     out = res.stdout
     pkg = "power/energy-pkg/" if "power/energy-pkg/" in out else "power/energy-pkg"
@@ -294,22 +340,31 @@ def measure_test(test_cmd, pkg_event, core_event):
     start = time.time()
     
     # Pre-check: we relax this check because tcpdump tests often exit with 1
-    if not run_command(cmd, PROJECT_DIR, ignore_errors=True): 
+    if not run_command(["taskset", "-c", MEASURE_CPUS, "sh", "-c", cmd], PROJECT_DIR, ignore_errors=True): 
         logging.warning(f"Measurement pre-check failed (might be expected): {cmd}")
 
     duration = max(time.time() - start, 0.001)
     iterations = math.ceil(TARGET_DURATION_SEC / duration)
     loop_cmd = f"for i in $(seq 1 {iterations}); do {cmd} >/dev/null 2>&1; done"
-    perf_cmd = f"perf stat -a -e {pkg_event},{core_event},cycles,instructions -x, sh -c '{loop_cmd}'"
+    # Counts go to their own file so nothing the test prints can mix into the CSV.
+    fd, perf_out = tempfile.mkstemp(prefix="perf_", suffix=".csv", dir=CACHE_DIR)
+    os.close(fd)
+    perf_argv = ["perf", "stat", "-a", "-e", f"{pkg_event},{core_event},cycles,instructions", "-x,",
+                 "--output", perf_out, "--", "taskset", "-c", MEASURE_CPUS, "sh", "-c", loop_cmd]
     
-    res = subprocess.run(perf_cmd, cwd=PROJECT_DIR, shell=True, stderr=subprocess.PIPE, text=True)
+    try:
+        res = subprocess.run(perf_argv, cwd=PROJECT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        with open(perf_out, 'r') as f:
+            perf_lines = f.read().split('\n')
+    finally:
+        os.remove(perf_out)
     
     # RELAXED PERF PARSING
     # We parse data FIRST. If we get data, we ignore the return code.
     metrics = {"energy_pkg": 0.0, "energy_core": 0.0, "cycles": 0, "instructions": 0}
     parse_success = False
 
-    for line in res.stderr.split('\n'):
+    for line in perf_lines:
         parts = line.split(',')
         if len(parts) < 3: continue
         try:
@@ -444,13 +499,14 @@ def main():
         sys.exit(1)
 
     print(f"Found {len(pairs)} pairs for {REPO_NAME}.")
+    seen_pairs = load_seen_pairs(MASTER_P1_CSV)
     for i, (vuln, fix) in enumerate(pairs):
         print(f"\n[{i+1}/{len(pairs)}] Processing Pair: {vuln[:8]} -> {fix[:8]}")
         
         p1_cache = os.path.join(CACHE_DIR, f"ckpt_cov_{vuln[:8]}.json")
         p2_cache = os.path.join(CACHE_DIR, f"ckpt_eng_{vuln[:8]}_{fix[:8]}.json")
 
-        success_p1 = run_phase_1_coverage(vuln, fix, MASTER_P1_CSV, p1_cache)
+        success_p1 = run_phase_1_coverage(vuln, fix, MASTER_P1_CSV, p1_cache, seen_pairs)
         if success_p1:
             run_phase_2_energy(MASTER_P1_CSV, MASTER_P2_CSV, p2_cache, vuln, fix)
         else:
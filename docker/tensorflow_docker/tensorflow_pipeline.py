@@ -1,14 +1,18 @@
+from __future__ import annotations
+
 import os
 import subprocess
 import csv
 import logging
 import json
 import time
+import math
 import sys
 import urllib.request
 import re
 import shlex
-import yaml
+import functools
+import shutil
 
 # [KEEP] Project-Independent Helpers (Restored Exact Original)
 class ProgressBar:
@@ -37,8 +41,8 @@ class ProgressBar:
 # ==========================================
 REPO_NAME = "tensorflow"
 TARGET_DURATION_SEC = 2.0
-CSV_WRITE_INTERVAL = 50
 TEST_LIMIT = None
+TEST_BATCH_SIZE = 50
 
 # [FIX] Updated URL
 GIST_CSV_URL = "https://gist.githubusercontent.com/waheed-sep/935cfc1ba42b2475d45336a4c779cbc8/raw/cwe_projects.csv"
@@ -54,6 +58,13 @@ PROJECT_DIR = os.path.join(INPUT_DIR, REPO_NAME)
 LOG_DIR = os.path.join(OUTPUT_DIR, "log")
 CACHE_DIR = os.path.join(LOG_DIR, "cache")
 GCDA_DIR = os.path.join(OUTPUT_DIR, "gcda_files")
+# Mount CACHE_DIR as a volume so Bazel's caches survive container restarts.
+BAZEL_DISK_CACHE = os.path.join(CACHE_DIR, "bazel_disk")
+BAZEL_REPO_CACHE = os.path.join(CACHE_DIR, "bazel_repo")
+BAZEL_REMOTE_CACHE = os.environ.get("BAZEL_REMOTE_CACHE", "")
+BAZEL_TEST_TMPDIR = "/dev/shm/bzl"
+# perf writes here (tmpfs) while the test runs; results are moved afterwards.
+PERF_TMP_DIR = "/dev/shm/perf"
 
 ITERATIONS = 5
 DEFAULT_TIMEOUT_MS = 10000 
@@ -62,7 +73,7 @@ COOL_DOWN_TO_SEC = 1.0
 ENERGY_RE = re.compile(r'\bpower/energy-[^/\s]+/?\b')
 
 def prepare_directories():
-    for d in [INPUT_DIR, OUTPUT_DIR, LOG_DIR, CACHE_DIR, GCDA_DIR]:
+    for d in [INPUT_DIR, OUTPUT_DIR, LOG_DIR, CACHE_DIR, GCDA_DIR, BAZEL_TEST_TMPDIR, PERF_TMP_DIR]:
         if not os.path.exists(d): os.makedirs(d)
 
 def setup_logging():
@@ -70,14 +81,18 @@ def setup_logging():
     logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # [KEEP] Restored Exact Original
-def run_command(command, cwd, ignore_errors=False):
+def run_command(command, cwd, ignore_errors=False, extra_env=None):
     try:
+        # argv lists (or shlex-split strings) run without an intermediate /bin/sh.
+        argv = shlex.split(command) if isinstance(command, str) else command
         env = os.environ.copy()
         env["LC_ALL"] = "C"
-        result = subprocess.run(command, cwd=cwd, shell=True, env=env,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if extra_env: env.update(extra_env)
+        # stdout is never read; stderr stays raw bytes and is decoded only on failure.
+        result = subprocess.run(argv, cwd=cwd, shell=False, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
         if result.returncode != 0 and not ignore_errors:
-            logging.error(f"FAIL: {command}\nSTDERR: {result.stderr.strip()}")
+            logging.error("FAIL: %s\nSTDERR: %s", command, result.stderr.decode('utf-8', 'replace').strip())
             return False
         return True
     except Exception as e:
@@ -96,9 +111,20 @@ def load_json(filepath):
         except: return {}
     return {}
 
+def _git(*args, cwd=PROJECT_DIR):
+    # Direct `git -C` call: no shell, no env copy, stdout discarded.
+    result = subprocess.run(["git", "-C", cwd, *args], check=False,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        logging.error(f"FAIL: git {' '.join(args)}\nSTDERR: {result.stderr.decode(errors='replace').strip()}")
+        return False
+    return True
+
 def clean_repo(cwd):
-    run_command("git reset --hard", cwd)
-    run_command("git clean -fdx", cwd)
+    # Keep Bazel's convenience symlinks so the next build stays incremental.
+    _git("reset", "--hard", "--quiet", cwd=cwd)
+    _git("clean", "-fdx", "--quiet",
+         "-e", "bazel-*", "-e", ".bazelrc", "-e", "external", "-e", "bazel-out", cwd=cwd)
 
 def download_csv_if_missing():
     if not os.path.exists(INPUT_CSV):
@@ -111,51 +137,62 @@ def download_csv_if_missing():
             sys.exit(1)
 
 def get_git_diff_files(cwd, commit_hash):
-    cmd = f"git diff-tree --no-commit-id --name-only -r {commit_hash}"
-    result = subprocess.run(cmd, cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
-    return {f for f in result.stdout.strip().split('\n') if f}
-
-def get_covered_files(cwd):
-    covered = set()
-    for root, dirs, files in os.walk(cwd):
-        for file in files:
-            if file.endswith(".gcda"):
-                source_name = file.replace(".gcda", ".c")
-                rel_dir = os.path.relpath(root, cwd)
-                full_path = source_name if rel_dir == "." else os.path.join(rel_dir, source_name)
-                covered.add(full_path)
-    return list(covered)
-
-def flush_buffer_to_csv(filepath, buffer, fieldnames):
-    if not buffer: return
-    file_exists = os.path.exists(filepath)
-    try:
-        with open(filepath, 'a', newline='') as f:
-            writer = csv.writer(f)
-            if not file_exists:
-                writer.writerow(fieldnames)
-            writer.writerows(buffer)
-            f.flush()
-            os.fsync(f.fileno())
-        buffer.clear()
-    except Exception as e:
-        logging.error(f"Failed to write CSV: {e}")
+    cmd = ["git", "-C", cwd, "diff-tree", "--no-commit-id", "--name-only", "-r", commit_hash]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True) as proc:
+        return {f for f in (l.strip() for l in proc.stdout) if f}
+
+def _scan_gcda(root):
+    # scandir exposes the entry type without an extra stat per file.
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try: it = os.scandir(d)
+        except OSError: continue
+        with it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(e.path)
+                elif e.name.endswith(".gcda"):
+                    yield e.path
+
+def purge_gcda(cwd):
+    # Only matters when Bazel runs unsandboxed and drops .gcda into the tree.
+    for path in _scan_gcda(cwd):
+        try: os.unlink(path)
+        except OSError: pass
 
 # ==========================================
 # [UPDATED] TENSORFLOW SPECIFIC
 # ==========================================
+def bazel_version(cwd):
+    # bazelisk resolves the commit's .bazelversion, so ask from inside the tree.
+    try:
+        out = subprocess.run(["bazel", "--version"], cwd=cwd, stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, text=True).stdout
+    except OSError:
+        return None
+    m = re.search(r'(\d+)\.(\d+)', out)
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+def bazel_download_regex_flag(cwd):
+    # --remote_download_regex is Bazel 7+; 6.x only has the experimental name
+    # and older releases have neither.
+    version = bazel_version(cwd)
+    if version is None or version < (6, 0):
+        return None
+    return "--remote_download_regex" if version >= (7, 0) else "--experimental_remote_download_regex"
+
 def configure_tensorflow(cwd, coverage=False):
     # 1. Run Configure (Non-Interactive via Env Vars)
-    # We prefix variables strictly in the command string, preserving run_command's independence.
-    config_cmd = (
-        "TF_NEED_CUDA=0 TF_NEED_ROCM=0 TF_DOWNLOAD_CLANG=0 "
-        "CC_OPT_FLAGS='-Wno-sign-compare' "
-        "PYTHON_BIN_PATH=$(which python3) "
-        "USE_DEFAULT_PYTHON_LIB_PATH=1 "
-        "./configure"
-    )
+    # The answers are passed through the environment, so no shell is needed.
+    config_env = {
+        "TF_NEED_CUDA": "0", "TF_NEED_ROCM": "0", "TF_DOWNLOAD_CLANG": "0",
+        "CC_OPT_FLAGS": "-Wno-sign-compare",
+        "PYTHON_BIN_PATH": shutil.which("python3") or "python3",
+        "USE_DEFAULT_PYTHON_LIB_PATH": "1",
+    }
     
-    if not run_command(config_cmd, cwd, ignore_errors=True):
+    if not run_command(["./configure"], cwd, ignore_errors=True, extra_env=config_env):
         return False
 
     # 2. Modify .bazelrc to control Phase 1 vs Phase 2
@@ -163,15 +200,39 @@ def configure_tensorflow(cwd, coverage=False):
     # complying with the generic script logic.
     bazelrc_path = os.path.join(cwd, ".bazelrc")
     
+    # Shared caches: the second commit of a pair and the energy rebuild reuse
+    # every action the previous build already produced. Test results are never
+    # cached since both phases need the tests to actually run.
+    flags = f"build:vfec --disk_cache={BAZEL_DISK_CACHE}\n"
+    flags += f"build:vfec --repository_cache={BAZEL_REPO_CACHE}\n"
+    if BAZEL_REMOTE_CACHE:
+        flags += f"build:vfec --remote_cache={BAZEL_REMOTE_CACHE}\n"
+        # Intermediate objects stay remote; only what the phase reads is fetched.
+        # The regex flag depends on the Bazel that bazelisk picks for this commit.
+        regex_flag = bazel_download_regex_flag(cwd) if coverage else None
+        if regex_flag:
+            flags += "build:vfec --remote_download_minimal\n"
+            flags += f"build:vfec {regex_flag}='.*\\.(gcda|gcno|dat)$'\n"
+        else:
+            flags += "build:vfec --remote_download_toplevel\n"
+    flags += "build --config=vfec\n"
+    flags += "build --jobs=HOST_CPUS\n"
+    flags += f"test --test_tmpdir={BAZEL_TEST_TMPDIR}\n"
+
     # Base flags (Common)
-    flags = "build --nocache_test_results --test_output=errors\n"
+    # Keep Bazel's console output small; failures are still in bazel-testlogs.
+    flags += "common --noshow_progress --color=no --curses=no\n"
+    flags += "test --nocache_test_results --test_output=summary\n"
     
     if coverage:
         # Phase 1: Enable GCOV
         flags += "build --collect_code_coverage --instrumentation_filter=//tensorflow/core/...\n"
+        # Concurrent instrumented tests can corrupt shared gcov counters.
+        flags += "test --local_test_jobs=1 --test_strategy=exclusive\n"
     else:
         # Phase 2: Enable Optimization (Energy)
         flags += "build -c opt\n"
+        flags += "test --local_test_jobs=HOST_CPUS\n"
 
     try:
         with open(bazelrc_path, "a") as f: # Append to existing config
@@ -183,7 +244,7 @@ def configure_tensorflow(cwd, coverage=False):
 
 def build_tensorflow(cwd):
     # Verify Bazel is ready
-    if run_command("bazel version", cwd):
+    if run_command(["bazel", "version"], cwd):
         return True
     logging.error("Bazel check failed.")
     return False
@@ -193,23 +254,24 @@ def get_tensorflow_tests(cwd):
     logging.info("Querying Bazel for tests...")
     
     # Query for C++ tests
-    cmd = "bazel query 'kind(cc_test, //tensorflow/core/...)'"
+    cmd = ["bazel", "query", "kind(cc_test, //tensorflow/core/...)"]
     
     try:
-        # We must run this directly to parse stdout
-        res = subprocess.run(cmd, cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
-        found_targets = [l.strip() for l in res.stdout.split('\n') if l.strip()]
-        
-        for target in found_targets:
-            t_name = target.replace("//", "").replace("/", "_").replace(":", "_")
-            
-            # GENERIC COMMAND: We rely on .bazelrc (configured above) 
-            # to switch between coverage/energy modes.
-            tests.append({
-                "name": t_name,
-                "cmd": f"bazel test {target}",
-                "type": "bazel"
-            })
+        # Stream stdout line by line instead of buffering the whole query result
+        with subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, text=True, bufsize=1) as proc:
+            for line in proc.stdout:
+                target = line.strip()
+                if not target: continue
+                t_name = target.replace("//", "").replace("/", "_").replace(":", "_")
+                
+                # GENERIC COMMAND: We rely on .bazelrc (configured above) 
+                # to switch between coverage/energy modes.
+                tests.append({
+                    "name": t_name,
+                    "target": target,
+                    "cmd": f"bazel test {target}",
+                    "type": "bazel"
+                })
             
     except Exception as e:
         logging.error(f"Bazel query failed: {e}")
@@ -219,22 +281,57 @@ def get_tensorflow_tests(cwd):
         
     return tests
 
+def get_testlog_dir(cwd, target):
+    # //tensorflow/core/foo:bar_test -> bazel-testlogs/tensorflow/core/foo/bar_test
+    pkg, _, name = target.lstrip("@/").partition(":")
+    return os.path.join(cwd, "bazel-testlogs", pkg, name)
+
+def parse_lcov(path):
+    covered = set()
+    try:
+        with open(path, 'r', errors='replace') as f:
+            for line in f:
+                if line.startswith("SF:"):
+                    covered.add(line[3:].strip())
+    except OSError:
+        pass
+    return covered
+
+def read_test_statuses(bep_path):
+    # Per-target results from Bazel's build event stream (one JSON per line).
+    statuses = {}
+    try:
+        with open(bep_path, 'r') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                label = event.get("id", {}).get("testSummary", {}).get("label")
+                if label:
+                    statuses["//" + label.lstrip("@/")] = event.get("testSummary", {}).get("overallStatus", "")
+    except OSError:
+        pass
+    return statuses
+
 # ==========================================
 # PHASE 1: COVERAGE (Restored Exact Original)
 # ==========================================
 
-def process_commit(commit: str, coverage: bool = True) -> (dict | None):
+def process_commit(commit: str, coverage: bool = True, clean: bool = True) -> (dict | None):
     """ 
     Process a single commit: checkout, build with coverage, run tests, collect coverage data.
 
     :param commit: The git commit hash to process
     :param coverage: Whether to build with coverage instrumentation
+    :param clean: Whether to clean and check out the commit first (skip if already done)
     :return: A dictionary with test results and coverage data, or None if build fails
     """
     
     logging.info(f"Building {commit[:8]} (Coverage)...")
-    clean_repo(PROJECT_DIR)
-    run_command(f"git checkout -f {commit}", PROJECT_DIR)
+    if clean:
+        clean_repo(PROJECT_DIR)
+        _git("checkout", "-f", "--quiet", commit)
     
     commit_results = {
         "hash": commit,
@@ -247,31 +344,40 @@ def process_commit(commit: str, coverage: bool = True) -> (dict | None):
     
     # [UPDATED CALL]
     suite = get_tensorflow_tests(PROJECT_DIR)
-    print(f"\nRunning {len(suite)} tests...")
+    batches = [suite[i:i + TEST_BATCH_SIZE] for i in range(0, len(suite), TEST_BATCH_SIZE)]
+    print(f"\nRunning {len(suite)} tests in {len(batches)} batches...")
 
-    pb = ProgressBar(len(suite), step=10)
-    for i, t in enumerate(suite):
+    # Clean previous coverage data
+    purge_gcda(PROJECT_DIR)
+
+    # One loading/analysis phase per batch instead of per target. Status comes
+    # from the build event stream and coverage from each target's coverage.dat.
+    bep_path = os.path.join(CACHE_DIR, f"bep_{commit[:8]}.json")
+    pb = ProgressBar(len(batches), step=10)
+    for i, batch in enumerate(batches):
         pb.set(i)
 
-        test = {
-            "name": t['name'],
-            "failed": False,
-            "cmd": t['cmd'],
-            "covered_files": []
-        }
+        batch_cmd = ["bazel", "test", "--keep_going", f"--build_event_json_file={bep_path}"] + [t['target'] for t in batch]
+        run_command(batch_cmd, PROJECT_DIR, ignore_errors=True)
+        statuses = read_test_statuses(bep_path)
+
+        for t in batch:
+            test = {
+                "name": t['name'],
+                "failed": False,
+                "cmd": t['cmd'],
+                "covered_files": []
+            }
+
+            if statuses.get(t['target']) != "PASSED":
+                logging.warning(f"Test Build/Run Failed: {test.get('name')}")
+                test['failed'] = True
+                commit_results['tests'].append(test)
+                continue
 
-        # Clean previous coverage data
-        run_command("find . -name '*.gcda' -delete", PROJECT_DIR)
-        
-        if not run_command(test.get('cmd'), PROJECT_DIR):
-            logging.warning(f"Test Build/Run Failed: {test.get('name')}")
-            test['failed'] = True
+            coverage_dat = os.path.join(get_testlog_dir(PROJECT_DIR, t['target']), "coverage.dat")
+            test['covered_files'] = sorted(parse_lcov(coverage_dat))
             commit_results['tests'].append(test)
-            continue
-        
-        covered = get_covered_files(PROJECT_DIR)
-        test['covered_files'] = covered
-        commit_results['tests'].append(test)
         
     return commit_results
 
@@ -309,7 +415,7 @@ def run_phase_1_coverage(vuln, fix):
     }
     
     clean_repo(PROJECT_DIR)
-    if not run_command(f"git checkout -f {fix}", PROJECT_DIR):
+    if not _git("checkout", "-f", "--quiet", fix):
         logging.error(f"Failed to checkout fix commit: {fix}")
         return None
     
@@ -320,7 +426,8 @@ def run_phase_1_coverage(vuln, fix):
         return None
     
     # FIX COMMIT
-    coverage_results['fix_commit'] = process_commit(fix)
+    # The tree was just cleaned and checked out at fix above.
+    coverage_results['fix_commit'] = process_commit(fix, clean=False)
     if not coverage_results['fix_commit'] or all(t.get('failed', True) for t in coverage_results['fix_commit'].get('tests', [])):
         logging.error("No successful tests in fix commit. Skipping processing.")
         return None
@@ -357,20 +464,20 @@ def run_phase_1_coverage(vuln, fix):
 
     return coverage_results
     
-def extract_test_covering_git_changes(coverage_results, target_files):  
-    for target in target_files:
-        for test in coverage_results.get('tests', []):
-            if coverage_results.get('failed', {}).get('status', True):
-                continue
-        
-            for test in coverage_results.get('tests', []):
-                covered_files = test.get('covered_files', [])
-                test['keep'] = target in covered_files
+def extract_test_covering_git_changes(coverage_results, target_files):
+    # Keep a test if it covers ANY changed file (previously only the last target counted).
+    targets = set(target_files)
+    if coverage_results.get('failed', {}).get('status', False):
+        return
+    for test in coverage_results.get('tests', []):
+        test['keep'] = not targets.isdisjoint(test.get('covered_files', ()))
 
 # ==========================================
 # PHASE 2: ENERGY (Restored Exact Original)
 # ==========================================
+@functools.lru_cache(maxsize=1)
 def detect_rapl(perf_bin="perf"):
+    # RAPL events are fixed for the host, so `perf list` runs once per process.
     # --no-desc makes output easier to parse if supported; if not, fall back.
     cmd = [perf_bin, "list", "--no-desc"]
     try:
@@ -378,34 +485,23 @@ def detect_rapl(perf_bin="perf"):
     except subprocess.CalledProcessError:
         out = subprocess.check_output([perf_bin, "list"], text=True, stderr=subprocess.STDOUT)
 
-    events = set()
-    for line in out.splitlines():
-        # Grab all matches from the line (some lines may include multiple tokens)
-        for m in ENERGY_RE.findall(line):
-            # Normalize to the canonical perf selector form with trailing '/'
-            if not m.endswith("/"):
-                m += "/"
-            events.add(m)
-
-    return sorted(events)
-
-
-def _wrap_until_timeout(test_cmd: str, timeout_ms: int) -> str:
-    timeout_s = max(1, int((timeout_ms + 999) / 1000))  # ceil to seconds
-
-    wrapped = (
-        "bash -lc "
-        + shlex.quote(
-            f"""
-            set -e
-            end=$((SECONDS + {timeout_s}))
-            while [ $SECONDS -lt $end ]; do
-              {test_cmd}
-            done
-            """
-        )
-    )
-    return wrapped
+    # One regex pass over the whole buffer; [^/\s] never spans a line break.
+    # Normalize to the canonical perf selector form with trailing '/'
+    events = {m if m.endswith("/") else m + "/" for m in ENERGY_RE.findall(out)}
+
+    return tuple(sorted(events))
+
+
+def _timeout_s(timeout_ms: int) -> int:
+    return max(1, int((timeout_ms + 999) / 1000))  # ceil to seconds
+
+def _window_argv(test_cmd, iterations: int, timeout_ms: int) -> list:
+    # A fixed loop sized by the warm-up fills the window with whole runs.
+    # timeout(1) only guards against hangs (twice the window); hitting it
+    # means a run was cut short, so callers treat exit 124 as a failure.
+    # Like the old `set -e` loop, the first failing run fails the sample.
+    loop = f"for i in $(seq 1 {iterations}); do {{ {test_cmd}; }} >/dev/null 2>&1 || exit; done"
+    return ["timeout", str(2 * _timeout_s(timeout_ms)), "sh", "-c", loop]
 
 def measure_test(pkg_event, test, commit):#, core_event):
     # Accept a list from detect_rapl() or a single event string.
@@ -426,47 +522,66 @@ def measure_test(pkg_event, test, commit):#, core_event):
     os.makedirs(perf_dir, exist_ok=True)
 
     timeout_ms = test.get("timeout_ms", DEFAULT_TIMEOUT_MS)  # e.g. 5s default, tune per test
+
+    # One warm-up run sizes the loop; a test that alone overruns the window is skipped.
+    argv = shlex.split(test["cmd"]) if isinstance(test["cmd"], str) else list(test["cmd"])
+    start = time.time()
+    try:
+        subprocess.run(argv, cwd=PROJECT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       timeout=_timeout_s(timeout_ms))
+    except subprocess.TimeoutExpired:
+        logging.error(f"Warm-up of {test.get('name')} exceeded {timeout_ms}ms. Skipping test.")
+        return None
+    duration = max(time.time() - start, 0.001)
+    loop_iters = max(1, math.ceil(timeout_ms / 1000 / duration))
+
     print(f"\nMeasuring energy for test '{test.get('name')}': "
-          f"{ITERATIONS} iterations × {timeout_ms}ms timeout each")
+          f"{ITERATIONS} iterations × {loop_iters} runs (~{timeout_ms}ms) each")
 
+    perf_tmp = os.path.join(PERF_TMP_DIR, f"perf_{os.getpid()}.csv")
     for iteration in range(ITERATIONS):
         pb.set(iteration)
 
         perf_out = os.path.join(perf_dir, f"{commit}_{test.get('name')}__{iteration}.csv")
 
-        wrapped_cmd = _wrap_until_timeout(test["cmd"], timeout_ms)
-
         # Build perf as argv list (safer than huge shell string)
         perf_argv = [
             "perf", "stat",
             "-a",
             "-e", f"{perf_events}",
-            "-x,", "--output", perf_out,
+            "-x,", "--output", perf_tmp,
             "--",
         ]
-        perf_argv += ["sh", "-c", wrapped_cmd]
+        perf_argv += _window_argv(test["cmd"], loop_iters, timeout_ms)
 
         res = subprocess.run(
             perf_argv, 
             cwd=PROJECT_DIR, 
-            stdout=subprocess.PIPE, 
+            stdout=subprocess.DEVNULL, 
             stderr=subprocess.PIPE, 
             text=True)
         
         if res.returncode != 0: 
-            logging.error(f"[STD ERR] {test.get('name')}: {res.stderr}")
-            if os.path.exists(perf_out):
-                os.remove(perf_out)
+            reason = "hit the hang guard" if res.returncode == 124 else res.stderr
+            logging.error(f"[STD ERR] {test.get('name')}: {reason}")
+            if os.path.exists(perf_tmp):
+                os.remove(perf_tmp)
             logging.error(f"Perf Measurement removed due to error.")
             return None
-        
+
+        # tmpfs and the output volume differ, so this is a copy + unlink.
+        shutil.move(perf_tmp, perf_out)
         time.sleep(COOL_DOWN_TO_SEC)
-        
+
+    # perf totals cover the whole loop; the divisor for per-run values sits next to the CSVs.
+    save_json(os.path.join(perf_dir, f"{commit}_{test.get('name')}__loops.json"),
+              {"loop_iterations": loop_iters, "iterations": ITERATIONS})
     return None
 
 def read_configuration():
     config_file = os.path.join(BASE_DIR, "config.yaml")
     if os.path.exists(config_file):
+        import yaml  # Only paid for when a config file is actually present
         try:
             with open(config_file, 'r') as f:
                 logging.info(f"Configuration loaded from {config_file}")
@@ -489,12 +604,14 @@ def main():
     # [FIX] Keep the CSV fix (utf-8-sig + case insensitive) as accepted
     try:
         with open(INPUT_CSV, 'r', encoding='utf-8-sig') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                p_name = row.get('project', '').strip()
-                if p_name.lower() == REPO_NAME.lower():
-                    if row.get('vuln_commit') and row.get('fix_commit'):
-                        pairs.append((row['vuln_commit'], row['fix_commit']))
+            # Plain reader + header indexes: no per-row dict for three columns.
+            reader = csv.reader(f)
+            header = [h.strip().lower() for h in next(reader)]
+            pi, vi, fi = header.index('project'), header.index('vuln_commit'), header.index('fix_commit')
+            width = max(pi, vi, fi)
+            target = REPO_NAME.lower()
+            pairs = [(row[vi], row[fi]) for row in reader
+                     if len(row) > width and row[pi].strip().lower() == target and row[vi] and row[fi]]
     except Exception as e:
         sys.exit(1)
 
@@ -1,10 +1,8 @@
 import os
 import csv
 import logging
-import json
 import sys
 import importlib
-import urllib.request
 import vfec_output  # The Common Engine
 
 # ==========================================
@@ -59,40 +57,11 @@ except ImportError as e:
     print(f"Make sure you have created the engine file for '{REPO_NAME}'.")
     sys.exit(1)
 
-# ==========================================
-# HELPERS
-# ==========================================
-def save_cache(filepath, data):
-    with open(filepath, 'w') as f:
-        json.dump(data, f, indent=4)
-
-def load_cache(filepath):
-    if os.path.exists(filepath):
-        try:
-            with open(filepath, 'r') as f: return json.load(f)
-        except: return {}
-    return {}
-
-def download_csv_if_missing():
-    if not os.path.exists(INPUT_CSV):
-        print(f"Downloading CSV to {INPUT_CSV}...")
-        try:
-            urllib.request.urlretrieve(GIST_CSV_URL, INPUT_CSV)
-        except Exception as e:
-            print(f"Error downloading CSV: {e}")
-            sys.exit(1)
-
-def get_git_diff_files(cwd, commit_hash):
-    cmd = f"git diff-tree --no-commit-id --name-only -r {commit_hash}"
-    import subprocess
-    result = subprocess.run(cmd, cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
-    return {f for f in result.stdout.strip().split('\n') if f}
-
 # ==========================================
 # PHASE 1: COVERAGE
 # ==========================================
 def run_phase_1(vuln, fix, csv_manager, checkpoint_path):
-    cache = load_cache(checkpoint_path)
+    cache = vfec_output.load_cache(checkpoint_path)
     if cache.get("status") == "COMPLETE_P1":
         return True # Already done
 
@@ -101,7 +70,7 @@ def run_phase_1(vuln, fix, csv_manager, checkpoint_path):
     # 1. Checkout Fix & Diff
     vfec_output.clean_repo(PROJECT_DIR)
     if not vfec_output.run_command(f"git checkout -f {fix}", PROJECT_DIR): return False
-    target_files = get_git_diff_files(PROJECT_DIR, fix)
+    target_files = vfec_output.get_git_diff_files(PROJECT_DIR, fix)
     
     if not target_files:
         logging.error("No target files found in git diff.")
@@ -133,9 +102,9 @@ def run_phase_1(vuln, fix, csv_manager, checkpoint_path):
             
             if relevant:
                 vuln_results[test['name']] = relevant
-                save_cache(checkpoint_path, {"vuln_done": False, "results": vuln_results})
+                vfec_output.save_cache(checkpoint_path, {"vuln_done": False, "results": vuln_results})
         
-        save_cache(checkpoint_path, {"vuln_done": True, "results": vuln_results})
+        vfec_output.save_cache(checkpoint_path, {"vuln_done": True, "results": vuln_results})
 
     # 3. Build & Test FIX
     logging.info(f"Building Fix {fix} (Coverage)...")
@@ -167,7 +136,7 @@ def run_phase_1(vuln, fix, csv_manager, checkpoint_path):
 
     csv_manager.flush_all()
     cache["status"] = "COMPLETE_P1"
-    save_cache(checkpoint_path, cache)
+    vfec_output.save_cache(checkpoint_path, cache)
     return True
 
 # ==========================================
@@ -195,7 +164,7 @@ def run_phase_2(master_p1_csv, csv_manager, checkpoint_path, current_vuln, curre
 
     if not rows_to_process: return True
 
-    cache = load_cache(checkpoint_path)
+    cache = vfec_output.load_cache(checkpoint_path)
     pkg_event = vfec_output.detect_rapl()
 
     # 2. Measure VULN & FIX
@@ -222,7 +191,7 @@ def run_phase_2(master_p1_csv, csv_manager, checkpoint_path, current_vuln, curre
             
             if pkg_energy is not None:
                 cache[commit][t_name] = pkg_energy
-                save_cache(checkpoint_path, cache)
+                vfec_output.save_cache(checkpoint_path, cache)
 
     # 3. Write Phase 2 CSV
     for row in rows_to_process:
@@ -242,7 +211,7 @@ def run_phase_2(master_p1_csv, csv_manager, checkpoint_path, current_vuln, curre
 # MAIN
 # ==========================================
 def main():
-    download_csv_if_missing()
+    vfec_output.download_csv_if_missing(INPUT_CSV, GIST_CSV_URL)
 
     MASTER_P1_CSV = os.path.join(OUTPUT_DIR, f"{REPO_NAME}_MASTER_testCompile.csv")
     MASTER_P2_CSV = os.path.join(OUTPUT_DIR, f"{REPO_NAME}_MASTER_energyperf.csv")
@@ -252,11 +221,15 @@ def main():
     pairs = []
     print(f"Reading {INPUT_CSV} for project: {REPO_NAME}...")
     try:
-        with open(INPUT_CSV, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get('project') == REPO_NAME and 'vuln_commit' in row and 'fix_commit' in row:
-                    pairs.append((row['vuln_commit'], row['fix_commit']))
+        with open(INPUT_CSV, 'r', encoding='utf-8-sig') as f:
+            # Plain reader + header indexes: no per-row dict for three columns.
+            reader = csv.reader(f)
+            header = [h.strip().lower() for h in next(reader)]
+            pi, vi, fi = header.index('project'), header.index('vuln_commit'), header.index('fix_commit')
+            width = max(pi, vi, fi)
+            target = REPO_NAME.lower()
+            pairs = [(row[vi], row[fi]) for row in reader
+                     if len(row) > width and row[pi].strip().lower() == target and row[vi] and row[fi]]
     except Exception as e:
         print(f"Error reading input CSV: {e}")
         sys.exit(1)
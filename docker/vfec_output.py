@@ -1,11 +1,17 @@
 import os
 import subprocess
-import csv
 import logging
 import json
 import time
 import math
 import sys
+import re
+import functools
+import collections
+import csv
+import atexit
+import urllib.request
+import shutil
 
 # ==========================================
 # FILE SYSTEM & LOGGING HELPERS
@@ -31,6 +37,31 @@ def run_command(command, cwd, ignore_errors=False):
         logging.error(f"EXCEPTION: {e}")
         return False
 
+def save_cache(filepath, data):
+    with open(filepath, 'w') as f:
+        json.dump(data, f, indent=4)
+
+def load_cache(filepath):
+    if os.path.exists(filepath):
+        try:
+            with open(filepath, 'r') as f: return json.load(f)
+        except: return {}
+    return {}
+
+def download_csv_if_missing(csv_path, url):
+    if not os.path.exists(csv_path):
+        print(f"Downloading CSV to {csv_path}...")
+        try:
+            urllib.request.urlretrieve(url, csv_path)
+        except Exception as e:
+            print(f"Error downloading CSV: {e}")
+            sys.exit(1)
+
+def get_git_diff_files(cwd, commit_hash):
+    cmd = f"git diff-tree --no-commit-id --name-only -r {commit_hash}"
+    result = subprocess.run(cmd, cwd=cwd, shell=True, stdout=subprocess.PIPE, text=True)
+    return {f for f in result.stdout.strip().split('\n') if f}
+
 def clean_repo(cwd):
     run_command("git reset --hard", cwd)
     run_command("git clean -fdx", cwd)
@@ -50,13 +81,51 @@ def get_covered_files(cwd):
 # ==========================================
 # MEASUREMENT ENGINE (PERF / ENERGY)
 # ==========================================
+RAPL_EVENTS_DIR = "/sys/bus/event_source/devices/power/events"
+# Resolved once; perf is then exec'd by absolute path without a shell
+PERF = shutil.which("perf")
+
+@functools.lru_cache(maxsize=1)
 def detect_rapl():
-    """Detects the specific RAPL event name for Package energy"""
-    res = subprocess.run("perf list", shell=True, stdout=subprocess.PIPE, text=True)
+    """Detects the specific RAPL event name for Package energy (cached per process)"""
+    # The power PMU's sysfs events dir is authoritative and avoids spawning perf list
+    if os.path.exists(os.path.join(RAPL_EVENTS_DIR, "energy-pkg")): return "power/energy-pkg/"
+    if not PERF: return "power/energy-pkg/"
+    res = subprocess.run([PERF, "list"], stdout=subprocess.PIPE, text=True)
     out = res.stdout
     if "power/energy-pkg/" in out: return "power/energy-pkg/"
     return "power/energy-pkg" # Fallback
 
+RAPL_PKG_ZONE = "/sys/class/powercap/intel-rapl:0"
+
+class RaplReader:
+    """Keeps the powercap energy_uj files open and reads them with pread"""
+    def __init__(self, zones):
+        self.fds = []
+        self.max_ranges = []
+        for zone in zones:
+            with open(os.path.join(zone, "max_energy_range_uj")) as f:
+                self.max_ranges.append(int(f.read()))
+            self.fds.append(os.open(os.path.join(zone, "energy_uj"), os.O_RDONLY))
+
+    def read(self):
+        return [int(os.pread(fd, 32, 0)) for fd in self.fds]
+
+    def delta_joules(self, before, after):
+        # energy_uj wraps around at max_energy_range_uj
+        return [((a - b) % m) / 1e6 for b, a, m in zip(before, after, self.max_ranges)]
+
+@functools.lru_cache(maxsize=1)
+def get_rapl_reader():
+    """Package RAPL reader over powercap sysfs, or None if not readable (cached per process)"""
+    try:
+        return RaplReader([RAPL_PKG_ZONE])
+    except OSError:
+        return None
+
+# perf -x, lines: value,unit,event,... ("<not supported>" values never match)
+PERF_LINE_RE = re.compile(rb'^([\d.]+),[^,]*,([^,]+),', re.M)
+
 def measure_energy(cmd, cwd, target_duration=2.0, pkg_event="power/energy-pkg/"):
     """
     Runs the command, stabilizes duration, and captures ONLY Energy-PKG.
@@ -72,38 +141,53 @@ def measure_energy(cmd, cwd, target_duration=2.0, pkg_event="power/energy-pkg/")
     duration = max(time.time() - start, 0.001)
     iterations = math.ceil(target_duration / duration)
     
-    # 3. Construct Loop Command
-    loop_cmd = f"for i in $(seq 1 {iterations}); do {cmd} >/dev/null 2>&1; done"
-    
-    # 4. Perf Command (PKG ONLY)
-    # -x, means CSV output format
-    perf_cmd = f"perf stat -a -e {pkg_event} -x, sh -c '{loop_cmd}'"
+    # 3a. Direct powercap read (no perf fork/exec or stderr parse)
+    rapl = get_rapl_reader()
+    if rapl:
+        loop_cmd = f"for i in $(seq 1 {iterations}); do {cmd} >/dev/null 2>&1; done"
+        before = rapl.read()
+        res = subprocess.run(["sh", "-c", loop_cmd], cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        after = rapl.read()
+        if res.returncode != 0:
+            # Loop exit status is the last run's; a failing test is not a valid sample
+            logging.error(f"Measured loop failed (exit {res.returncode}): {cmd}")
+            return None
+        return rapl.delta_joules(before, after)[0] / iterations
+
+    # 3b. Perf Command (PKG ONLY)
+    # -x, means CSV output format; -r runs the child N times itself (no shell loop)
+    if not PERF:
+        logging.error("perf not found in PATH and powercap RAPL is unavailable.")
+        return None
+    perf_argv = [PERF, "stat", "-a", "-r", str(iterations), "-e", pkg_event, "-x,",
+                 "sh", "-c", f"{cmd} >/dev/null 2>&1"]
     
-    res = subprocess.run(perf_cmd, cwd=cwd, shell=True, stderr=subprocess.PIPE, text=True)
+    proc = subprocess.Popen(perf_argv, cwd=cwd, stderr=subprocess.PIPE)
     
-    # 5. Parse Output
+    # 4. Parse Output (streamed line by line; only a short tail is kept for errors)
+    # Output format example: 12.34,Joules,power/energy-pkg/,0.52%,100.00,,
     energy_pkg = None
-    
-    # Output format example: 12.34,Joules,power/energy-pkg/,100.00,,
-    for line in res.stderr.split('\n'):
-        parts = line.split(',')
-        if len(parts) < 3: continue
-        try:
-            val = float(parts[0])
-            evt = parts[2]
-            if "energy-pkg" in evt: 
-                energy_pkg = val
-                break # Found it, stop looking
-        except ValueError: continue
+    tail = collections.deque(maxlen=20)
+    for line in proc.stderr:
+        m = PERF_LINE_RE.match(line) if line[:1].isdigit() else None
+        if m and b"energy-pkg" in m.group(2):
+            energy_pkg = float(m.group(1))
+            break # Found it, stop looking
+        elif line.startswith(b"<not supported>"):
+            logging.error(f"RAPL event not supported: {line.decode(errors='replace').strip()}")
+            proc.kill()
+            break
+        else:
+            tail.append(line)
+    returncode = proc.wait()
 
     if energy_pkg is None:
-        if res.returncode != 0:
-            logging.error(f"Perf execution failed: {res.stderr}")
+        if returncode != 0:
+            logging.error(f"Perf execution failed: {b''.join(tail).decode(errors='replace')}")
         return None
 
-    if iterations > 0:
-        return energy_pkg / iterations
-    return None
+    # perf -r already reports the per-run mean
+    return energy_pkg
 
 # ==========================================
 # CSV OUTPUT HANDLER
@@ -121,31 +205,55 @@ class CSVManager:
         self.header_p2 = ["project", "vuln_commit", "v_testname", "v_energy_pkg",
                           "fix_commit", "f_testname", "sourcefile", "f_energy_pkg"]
 
+        # Append-only handles stay open for the process lifetime; headers are written on open.
+        # The 1 MiB buffer holds a whole batch, so each flush is still a single write.
+        self._p1 = self._open(p1_path, self.header_p1)
+        self._p2 = self._open(p2_path, self.header_p2)
+        atexit.register(self.close)
+
+    @staticmethod
+    def _open(filepath, header):
+        f = open(filepath, 'a', newline='', buffering=1 << 20)
+        writer = csv.writer(f, lineterminator='\n')
+        if os.fstat(f.fileno()).st_size == 0:
+            writer.writerow(header)
+            f.flush()
+        return f, writer
+
     def add_p1(self, row):
         self.buffer_p1.append(row)
         if len(self.buffer_p1) >= self.interval:
-            self.flush(self.p1_path, self.buffer_p1, self.header_p1)
+            self.flush(self._p1, self.buffer_p1)
 
     def add_p2(self, row):
         self.buffer_p2.append(row)
         if len(self.buffer_p2) >= self.interval:
-            self.flush(self.p2_path, self.buffer_p2, self.header_p2)
+            self.flush(self._p2, self.buffer_p2)
 
     def flush_all(self):
-        self.flush(self.p1_path, self.buffer_p1, self.header_p1)
-        self.flush(self.p2_path, self.buffer_p2, self.header_p2)
+        """Writes both buffers and syncs the files (readers such as Phase 2 see the rows)."""
+        for handle, buffer in [(self._p1, self.buffer_p1), (self._p2, self.buffer_p2)]:
+            self.flush(handle, buffer)
+            f, _ = handle
+            try:
+                os.fsync(f.fileno())
+            except OSError as e:
+                logging.error(f"Failed to sync CSV {f.name}: {e}")
 
-    def flush(self, filepath, buffer, header):
+    def flush(self, handle, buffer):
+        """csv.writer quotes fields such as sourcefile paths that contain commas."""
         if not buffer: return
-        file_exists = os.path.exists(filepath)
+        f, writer = handle
         try:
-            with open(filepath, 'a', newline='') as f:
-                writer = csv.writer(f)
-                if not file_exists:
-                    writer.writerow(header)
-                writer.writerows(buffer)
-                f.flush()
-                os.fsync(f.fileno())
+            writer.writerows(buffer)
+            f.flush()
             buffer.clear()
-        except Exception as e:
-            logging.error(f"Failed to write CSV {filepath}: {e}")
\ No newline at end of file
+        except OSError as e:
+            logging.error(f"Failed to write CSV {f.name}: {e}")
+
+    def close(self):
+        if self._p1 is None: return
+        self.flush_all()
+        self._p1[0].close()
+        self._p2[0].close()
+        self._p1 = self._p2 = None
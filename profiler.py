@@ -4,9 +4,37 @@ import subprocess
 import csv
 import logging
 import time
-import math
 import json
 import sys
+import re
+import ctypes
+import fcntl
+import struct
+import functools
+import shlex
+import collections
+import atexit
+import shutil
+import multiprocessing
+import queue
+import threading
+import concurrent.futures
+import signal
+import sqlite3
+
+# Optional fast JSON for importing a legacy checkpoint file.
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Optional vectorized reader for large input CSVs.
+try:
+    import pandas as pd
+    PANDAS_AVAILABLE = True
+except ImportError:
+    PANDAS_AVAILABLE = False
 
 # ==========================================
 # CONFIGURATION
@@ -17,8 +45,12 @@ INPUT_CSV_NAME = "ImageMagick_96162eba_f221ea0f_testCompile.csv"
 # Target Duration per test (in seconds)
 TARGET_DURATION_SEC = 3.0
 
-# Batch size for writing to CSV
-CSV_WRITE_INTERVAL = 50 
+# Upper bound on measured iterations for very short tests
+MAX_ITERATIONS = 200
+
+
+# CPU (pick a P-core on hybrid parts) that measured tests are pinned to
+MEASURE_CPU = int(os.environ.get("MEASURE_CPU", "2"))
 
 # ==========================================
 # PATHS
@@ -31,7 +63,13 @@ CACHE_DIR = os.path.join(RESULTS_DIR, "cache")
 INPUT_CSV_PATH = os.path.join(RESULTS_DIR, INPUT_CSV_NAME)
 OUTPUT_CSV_PATH = os.path.join(RESULTS_DIR, INPUT_CSV_NAME.replace("_testCompile", "_energyperf"))
 LOG_FILE = os.path.join(LOG_DIR, "log_measure_energy.txt")
+CHECKPOINT_DB = os.path.join(CACHE_DIR, "measurements.db")
+# Earlier JSON checkpoint + append log, imported into the database once
 CHECKPOINT_FILE = os.path.join(CACHE_DIR, "measurements_checkpoint.json")
+APPEND_LOG = os.path.join(CACHE_DIR, "measurements.ndjson")
+BUILT_COMMITS_FILE = os.path.join(CACHE_DIR, "built_commits.json")
+CCACHE_DIR = os.path.join(CACHE_DIR, "ccache")
+WORKTREE_DIR = os.path.join(CACHE_DIR, "worktrees")
 
 SAMPLES_DIR = os.path.join(BASE_DIR, "ds_projects", "fate-samples")
 
@@ -45,8 +83,8 @@ PROJECT_DIR_MAP = {
 # ==========================================
 # LOGGING & SETUP
 # ==========================================
-for d in [RESULTS_DIR, LOG_DIR, CACHE_DIR]:
-    if not os.path.exists(d): os.makedirs(d)
+for d in [RESULTS_DIR, LOG_DIR, CACHE_DIR, CCACHE_DIR, WORKTREE_DIR]:
+    os.makedirs(d, exist_ok=True)
 
 logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 console = logging.StreamHandler()
@@ -61,10 +99,62 @@ def check_root():
         print("ERROR: This script must be run with sudo to access Energy (RAPL) counters.")
         sys.exit(1)
 
+NO_TURBO_FILE = "/sys/devices/system/cpu/intel_pstate/no_turbo"
+
+def restore_turbo(previous):
+    try:
+        with open(NO_TURBO_FILE, 'w') as f: f.write(previous)
+    except OSError as e:
+        logging.warning(f"Could not restore turbo setting: {e}")
+
+def prepare_measurement_cpu():
+    """Keeps this supervisor off MEASURE_CPU and disables Turbo until exit."""
+    others = os.sched_getaffinity(0) - {MEASURE_CPU}
+    if others: os.sched_setaffinity(0, others)
+
+    try:
+        with open(NO_TURBO_FILE) as f: previous = f.read().strip()
+        with open(NO_TURBO_FILE, 'w') as f: f.write("1")
+        atexit.register(restore_turbo, previous)
+    except OSError as e:
+        logging.warning(f"Could not disable turbo: {e}")
+
+RAPL_EVENTS_DIR = "/sys/bus/event_source/devices/power/events"
+# Resolved once; perf is then exec'd by absolute path without a shell
+PERF = shutil.which("perf")
+# perf list results, keyed by CPU model so a moved results dir re-detects
+RAPL_EVENTS_CACHE = os.path.join(CACHE_DIR, "rapl_events.json")
+
+def cpu_model():
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return ""
+
+@functools.lru_cache(maxsize=1)
 def detect_rapl_event_name():
-    cmd = "perf list"
-    res = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, text=True)
-    output = res.stdout
+    # The power PMU's sysfs events dir is the authoritative list; perf list is the fallback
+    if os.path.isdir(RAPL_EVENTS_DIR):
+        if "energy-pkg" in os.listdir(RAPL_EVENTS_DIR):
+            return "power/energy-pkg/", "power/energy-cores/"
+
+    model = cpu_model()
+    try:
+        with open(RAPL_EVENTS_CACHE, 'r') as f:
+            cached = json.load(f)
+        if cached["model"] == model:
+            return tuple(cached["events"])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    output = ""
+    if PERF:
+        res = subprocess.run([PERF, "list"], stdout=subprocess.PIPE, text=True)
+        output = res.stdout
     
     events = []
     # Check PKG
@@ -77,40 +167,315 @@ def detect_rapl_event_name():
     elif "power/energy-cores" in output: events.append("power/energy-cores")
     else: events.append("power/energy-cores/") 
 
+    # Only a real perf list answer is worth remembering
+    if output:
+        try:
+            with open(RAPL_EVENTS_CACHE, 'w') as f:
+                json.dump({"model": model, "events": events}, f)
+        except OSError:
+            pass
     return events[0], events[1]
 
-EVENT_PKG, EVENT_CORE = "power/energy-pkg/", "power/energy-cores/"
-if os.geteuid() == 0:
-    EVENT_PKG, EVENT_CORE = detect_rapl_event_name()
-    logging.info(f"Using RAPL Events: {EVENT_PKG}, {EVENT_CORE}")
+@functools.cache
+def rapl_events():
+    """(pkg, core) perf event names, resolved on first measurement rather than at import."""
+    if os.geteuid() != 0:
+        return "power/energy-pkg/", "power/energy-cores/"
+    pkg, core = detect_rapl_event_name()
+    logging.info(f"Using RAPL Events: {pkg}, {core}")
+    return pkg, core
 
-def save_checkpoint(data):
-    try:
-        with open(CHECKPOINT_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-    except Exception as e:
-        logging.error(f"Failed to save checkpoint: {e}")
+# ==========================================
+# RAPL (POWERCAP SYSFS)
+# ==========================================
+POWERCAP_DIR = "/sys/class/powercap"
+RAPL_PKG_ZONE = os.path.join(POWERCAP_DIR, "intel-rapl:0")
+
+def find_core_zone(pkg_zone):
+    """The package's "core" subzone, or None (intel-rapl:N:0 is "dram" on many servers)."""
+    prefix = os.path.basename(pkg_zone) + ":"
+    for entry in sorted(os.listdir(POWERCAP_DIR)):
+        if not entry.startswith(prefix): continue
+        try:
+            with open(os.path.join(POWERCAP_DIR, entry, "name")) as f:
+                if f.read().strip() == "core": return os.path.join(POWERCAP_DIR, entry)
+        except OSError:
+            continue
+    return None
+
+class RaplReader:
+    """Keeps the powercap energy_uj files open and reads them with pread (None zones read as 0)."""
+    def __init__(self, zones):
+        self.fds = []
+        self.max_ranges = []
+        for zone in zones:
+            if zone is None:
+                self.fds.append(None)
+                self.max_ranges.append(1)
+                continue
+            with open(os.path.join(zone, "max_energy_range_uj")) as f:
+                self.max_ranges.append(int(f.read()))
+            self.fds.append(os.open(os.path.join(zone, "energy_uj"), os.O_RDONLY))
+
+    def read(self):
+        return [int(os.pread(fd, 32, 0)) if fd is not None else 0 for fd in self.fds]
+
+    def delta_joules(self, before, after):
+        # energy_uj wraps around at max_energy_range_uj
+        return [((a - b) % m) / 1e6 for b, a, m in zip(before, after, self.max_ranges)]
+
+RAPL_INTERVAL_SEC = 0.2
+
+class RaplSampler(threading.Thread):
+    """Reads RAPL every RAPL_INTERVAL_SEC during the measured loop (like perf stat -I 200)."""
+    def __init__(self, rapl):
+        super().__init__(daemon=True)
+        self.rapl = rapl
+        self.samples = [(time.perf_counter(), rapl.read())]
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(RAPL_INTERVAL_SEC):
+            self.samples.append((time.perf_counter(), self.rapl.read()))
+
+    def stop(self):
+        self.done.set()
+        self.join()
+        self.samples.append((time.perf_counter(), self.rapl.read()))
+
+    def steady_joules(self):
+        """Energy over the whole run, extrapolated from the steady-state intervals.
+
+        Drops the first two intervals (cold caches, page faults) and the last
+        (partial) one; short runs without enough intervals use the plain delta.
+        """
+        (t0, first), (t1, last) = self.samples[0], self.samples[-1]
+        if len(self.samples) < 5:
+            return self.rapl.delta_joules(first, last)
+        (s0, start), (s1, end) = self.samples[2], self.samples[-2]
+        scale = (t1 - t0) / (s1 - s0)
+        return [j * scale for j in self.rapl.delta_joules(start, end)]
+
+_RAPL_READER = None
+
+def get_rapl_reader():
+    """Returns the shared RaplReader, or None if powercap is not readable (falls back to perf)."""
+    global _RAPL_READER
+    if _RAPL_READER is None:
+        try:
+            _RAPL_READER = RaplReader([RAPL_PKG_ZONE, find_core_zone(RAPL_PKG_ZONE)])
+        except OSError as e:
+            logging.warning(f"Powercap RAPL unavailable, using perf energy events: {e}")
+            _RAPL_READER = False
+    return _RAPL_READER or None
 
-def load_checkpoint():
+# ==========================================
+# PMU COUNTERS (PERF_EVENT_OPEN)
+# ==========================================
+NR_PERF_EVENT_OPEN = 298  # x86_64
+PERF_TYPE_HARDWARE = 0
+PERF_COUNT_HW_CPU_CYCLES = 0
+PERF_COUNT_HW_INSTRUCTIONS = 1
+PERF_FORMAT_GROUP = 1 << 3
+PERF_ATTR_INHERIT = 1 << 1  # perf_event_attr.flags bit 1
+PERF_EVENT_IOC_ENABLE = 0x2400
+PERF_EVENT_IOC_DISABLE = 0x2401
+PERF_EVENT_IOC_RESET = 0x2403
+PERF_IOC_FLAG_GROUP = 1
+
+class PerfEventAttr(ctypes.Structure):
+    # PERF_ATTR_SIZE_VER1 layout; flags bit 0 is "disabled", bit 1 "inherit"
+    _fields_ = [
+        ("type", ctypes.c_uint32), ("size", ctypes.c_uint32),
+        ("config", ctypes.c_uint64), ("sample_period", ctypes.c_uint64),
+        ("sample_type", ctypes.c_uint64), ("read_format", ctypes.c_uint64),
+        ("flags", ctypes.c_uint64), ("wakeup_events", ctypes.c_uint32),
+        ("bp_type", ctypes.c_uint32), ("config1", ctypes.c_uint64), ("config2", ctypes.c_uint64),
+    ]
+
+_LIBC = ctypes.CDLL(None, use_errno=True)
+
+def perf_event_open(config, group_fd=-1, disabled=False):
+    """Counter on the calling thread (pid=0, any CPU), inherited by every child it spawns."""
+    attr = PerfEventAttr(type=PERF_TYPE_HARDWARE, size=ctypes.sizeof(PerfEventAttr), config=config,
+                         read_format=PERF_FORMAT_GROUP, flags=PERF_ATTR_INHERIT | int(disabled))
+    fd = _LIBC.syscall(NR_PERF_EVENT_OPEN, ctypes.byref(attr), 0, -1, group_fd, ctypes.c_ulong(0))
+    if fd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return fd
+
+class PerfCounters:
+    """cycles+instructions of the test processes only: one inherited group on the measuring thread.
+
+    Children fold their counts back into the group when they exit, so after
+    waitpid() a single read() returns the totals for every spawned iteration.
+    """
+    def __init__(self):
+        self.leader = perf_event_open(PERF_COUNT_HW_CPU_CYCLES, disabled=True)
+        self.member = perf_event_open(PERF_COUNT_HW_INSTRUCTIONS, group_fd=self.leader)
+
+    def start(self):
+        fcntl.ioctl(self.leader, PERF_EVENT_IOC_RESET, PERF_IOC_FLAG_GROUP)
+        fcntl.ioctl(self.leader, PERF_EVENT_IOC_ENABLE, PERF_IOC_FLAG_GROUP)
+
+    def stop(self):
+        """Disables the group and returns (cycles, instructions)."""
+        fcntl.ioctl(self.leader, PERF_EVENT_IOC_DISABLE, PERF_IOC_FLAG_GROUP)
+        _, cycles, instructions = struct.unpack("QQQ", os.read(self.leader, 24))
+        return cycles, instructions
+
+    def close(self):
+        os.close(self.member)
+        os.close(self.leader)
+
+_PERF_COUNTERS = None
+
+def perf_counters_available():
+    """Probes perf_event_open once; False means measurements fall back to perf stat.
+
+    The probe group is closed again: inherit also follows threads created later,
+    so a group left open would count e.g. the RaplSampler thread as well.
+    """
+    global _PERF_COUNTERS
+    if _PERF_COUNTERS is None:
+        try:
+            PerfCounters().close()
+            _PERF_COUNTERS = True
+        except OSError as e:
+            logging.warning(f"perf_event_open unavailable, using perf stat: {e}")
+            _PERF_COUNTERS = False
+    return _PERF_COUNTERS
+
+def load_legacy_checkpoint():
+    data = {}
     if os.path.exists(CHECKPOINT_FILE):
         logging.info("Loading previous checkpoint...")
-        with open(CHECKPOINT_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+        if ORJSON_AVAILABLE:
+            with open(CHECKPOINT_FILE, 'rb') as f:
+                data = orjson.loads(f.read())
+        else:
+            with open(CHECKPOINT_FILE, 'r') as f:
+                data = json.load(f)
+
+    # Replay results logged after the last snapshot (a torn last line is dropped)
+    if os.path.exists(APPEND_LOG):
+        replayed = 0
+        loads = orjson.loads if ORJSON_AVAILABLE else json.loads
+        with open(APPEND_LOG, 'rb') as f:
+            for line in f:
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    continue
+                data.setdefault(entry["commit"], {})[entry["test"]] = entry["m"]
+                replayed += 1
+        if replayed:
+            logging.info(f"Replayed {replayed} results from {APPEND_LOG}")
+    return data
+
+# Results table: one row per (commit, test), written as each test finishes
+METRIC_COLUMNS = ("energy_pkg", "energy_core", "cycles", "ipc")
+
+def open_checkpoint():
+    # WAL: each result commit appends a page to the log instead of rewriting a file
+    db = sqlite3.connect(CHECKPOINT_DB)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("CREATE TABLE IF NOT EXISTS results (commit_hash TEXT, test TEXT, energy_pkg REAL, "
+               "energy_core REAL, cycles REAL, ipc REAL, PRIMARY KEY (commit_hash, test))")
+    empty = db.execute("SELECT 1 FROM results LIMIT 1").fetchone() is None
+    if empty and (os.path.exists(CHECKPOINT_FILE) or os.path.exists(APPEND_LOG)):
+        legacy = load_legacy_checkpoint()
+        with db:
+            for commit, tests in legacy.items():
+                for test, m in tests.items():
+                    save_result(db, commit, test, m, commit_now=False)
+        logging.info(f"Imported {sum(map(len, legacy.values()))} results from the JSON checkpoint")
+    return db
+
+def save_result(db, commit, test, metrics, commit_now=True):
+    try:
+        db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                   (commit, test, *(metrics[k] for k in METRIC_COLUMNS)))
+        if commit_now: db.commit()
+    except sqlite3.Error as e:
+        logging.error(f"Failed to save checkpoint: {e}")
+
+def load_checkpoint(db):
+    data = {}
+    for commit, test, *values in db.execute("SELECT * FROM results"):
+        data.setdefault(commit, {})[test] = dict(zip(METRIC_COLUMNS, values))
+    if data: logging.info("Loading previous checkpoint...")
+    return data
+
+# Builds go through ccache when it is installed (repeat commits become mostly cache hits)
+USE_CCACHE = shutil.which("ccache") is not None
+CCACHE_MAX_SIZE = "20G"
+BUILD_ENV = {**os.environ, "CCACHE_DIR": CCACHE_DIR}
+if USE_CCACHE:
+    BUILD_ENV.update(CC="ccache gcc", CXX="ccache g++")
+
+class ShellSession:
+    """One long-lived bash that orchestration commands are piped into (no sh fork+exec per call)."""
+    SENTINEL = "__VFEC_DONE__:"
+
+    def __init__(self):
+        self.proc = None
+
+    def _start(self):
+        self.proc = subprocess.Popen(["bash"], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.PIPE, text=True, bufsize=1, env=BUILD_ENV)
+
+    def run(self, command, cwd):
+        """Returns (returncode, last lines of stderr)."""
+        if self.proc is None or self.proc.poll() is not None:
+            self._start()
+        self.proc.stdin.write(f"cd {shlex.quote(cwd)} && {{ {command}\n}} </dev/null; "
+                              f"echo \"{self.SENTINEL}$?\" >&2\n")
+        self.proc.stdin.flush()
+        tail = collections.deque(maxlen=50)
+        for line in self.proc.stderr:
+            if self.SENTINEL in line:
+                before, _, code = line.rpartition(self.SENTINEL)
+                if before: tail.append(before)
+                return int(code), "".join(tail)
+            tail.append(line)
+        # The command exited the shell itself; the next call starts a new one
+        return self.proc.wait(), "".join(tail)
+
+SHELL = ShellSession()
 
 def run_command(command, cwd, ignore_errors=False):
+    """Runs an argv list directly (no shell), or a string through the persistent bash."""
     try:
-        result = subprocess.run(command, cwd=cwd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        if result.returncode != 0 and not ignore_errors:
-            logging.error(f"FAIL: {command}\nSTDERR: {result.stderr.strip()}")
+        if isinstance(command, list):
+            result = subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                    text=True, env=BUILD_ENV)
+            returncode, stderr = result.returncode, result.stderr[-4096:]
+            command = shlex.join(command)
+        else:
+            returncode, stderr = SHELL.run(command, cwd)
+        if returncode != 0 and not ignore_errors:
+            logging.error(f"FAIL: {command}\nSTDERR: {stderr.strip()}")
             return False
         return True
     except Exception as e:
         logging.error(f"EXCEPTION: {e}")
         return False
 
-def write_csv_from_cache(rows, results_cache):
-    logging.info("Writing intermediate CSV dump...")
+# Bound formatters, built once instead of per CSV field
+_f4 = "{:.4f}".format
+_f0 = "{:.0f}".format
+
+# v_/f_ metric columns: energy_pkg, energy_core, cycles, ipc
+def metric_fields(m):
+    return [_f4(m['energy_pkg']), _f4(m['energy_core']), _f0(m['cycles']), _f4(m['ipc'])]
+
+MISSING_METRICS = ["0", "0", "0", "0"]
+
+def write_csv_from_cache(rows, results_cache, final=False):
+    logging.info("Writing final CSV..." if final else "Writing intermediate CSV dump...")
     
     fieldnames = [
         "project", "vuln_commit", "v_testname", 
@@ -119,131 +484,276 @@ def write_csv_from_cache(rows, results_cache):
         "f_energy_pkg", "f_energy_core", "f_cycles", "f_ipc"
     ]
     
+    # List rows in fieldname order through csv.writer (no DictWriter field lookups)
     try:
         with open(OUTPUT_CSV_PATH, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
             
             for row in rows:
-                out_row = {
-                    "project": row['project'],
-                    "vuln_commit": row['vuln_commit'],
-                    "v_testname": row['v_testname'],
-                    "fix_commit": row['fix_commit'],
-                    "f_testname": row['f_testname'],
-                    "sourcefile": row['sourcefile'],
-                    "v_energy_pkg": "0", "v_energy_core": "0", "v_cycles": "0", "v_ipc": "0",
-                    "f_energy_pkg": "0", "f_energy_core": "0", "f_cycles": "0", "f_ipc": "0"
-                }
-                
                 # Fill Vuln Metrics
                 vc = row['vuln_commit']
                 vt = row['v_testname']
-                if vt and vc in results_cache and vt in results_cache[vc]:
-                    m = results_cache[vc][vt]
-                    out_row["v_energy_pkg"] = f"{m['energy_pkg']:.4f}"
-                    out_row["v_energy_core"] = f"{m['energy_core']:.4f}"
-                    out_row["v_cycles"] = f"{m['cycles']:.0f}"
-                    out_row["v_ipc"] = f"{m['ipc']:.4f}"
+                m = results_cache.get(vc, {}).get(vt) if vt else None
+                v_metrics = metric_fields(m) if m else MISSING_METRICS
 
                 # Fill Fix Metrics
                 fc = row['fix_commit']
                 ft = row['f_testname']
-                if ft and fc in results_cache and ft in results_cache[fc]:
-                    m = results_cache[fc][ft]
-                    out_row["f_energy_pkg"] = f"{m['energy_pkg']:.4f}"
-                    out_row["f_energy_core"] = f"{m['energy_core']:.4f}"
-                    out_row["f_cycles"] = f"{m['cycles']:.0f}"
-                    out_row["f_ipc"] = f"{m['ipc']:.4f}"
+                m = results_cache.get(fc, {}).get(ft) if ft else None
+                f_metrics = metric_fields(m) if m else MISSING_METRICS
                 
-                writer.writerow(out_row)
-            f.flush()
-            os.fsync(f.fileno())
+                writer.writerow([row['project'], vc, vt, *v_metrics, fc, ft, row['sourcefile'], *f_metrics])
+            # Intermediate dumps are rebuilt from the checkpoint anyway; only the last one is synced
+            if final:
+                f.flush()
+                os.fsync(f.fileno())
     except Exception as e:
         logging.error(f"Failed to write CSV: {e}")
 
+# Per-project test command templates, filled with str.format
+TEST_COMMAND_TEMPLATES = {
+    "FFmpeg": "make {test} SAMPLES={samples} -j1",
+    "openssl": "make test TESTS='{test}'",
+    # Reconstruct the tap path: validate-import -> tests/validate-import.tap
+    "ImageMagick": "make check TESTS='tests/{test}.tap'",
+}
+
 def get_test_command(project, test_name, cwd):
-    if project == "FFmpeg":
-        return f"make {test_name} SAMPLES={SAMPLES_DIR} -j1"
-    elif project == "openssl":
-        return f"make test TESTS='{test_name}'"
-    elif project == "ImageMagick":
-        # Reconstruct the tap path: validate-import -> tests/validate-import.tap
-        return f"make check TESTS='tests/{test_name}.tap'"
-    return None
+    template = TEST_COMMAND_TEMPLATES.get(project)
+    if template is None: return None
+    return template.format(test=test_name, samples=SAMPLES_DIR)
+
+def load_built_commits():
+    if os.path.exists(BUILT_COMMITS_FILE):
+        try:
+            with open(BUILT_COMMITS_FILE, 'r') as f: return json.load(f)
+        except (OSError, ValueError): pass
+    return {}
+
+def save_built_commits(update):
+    # Locked read-modify-write: concurrent builders must not drop each other's entries
+    with open(BUILT_COMMITS_FILE + ".lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        built = load_built_commits()
+        update(built)
+        tmp = BUILT_COMMITS_FILE + f".{os.getpid()}.tmp"
+        with open(tmp, 'w') as f: json.dump(built, f)
+        os.replace(tmp, BUILT_COMMITS_FILE)
+
+def worktree_path(project, commit_hash):
+    return os.path.join(WORKTREE_DIR, f"{project}_{commit_hash[:12]}")
+
+def spare_path(project):
+    # One finished worktree per project, kept with its build objects for the next commit
+    return os.path.join(WORKTREE_DIR, f"{project}_spare")
 
 def clean_and_checkout(project, commit_hash):
-    cwd = PROJECT_DIR_MAP.get(project)
-    if not cwd or not os.path.exists(cwd):
+    """Builds the commit in its own git worktree and returns that path (None on failure)."""
+    repo = PROJECT_DIR_MAP.get(project)
+    if not repo or not os.path.exists(repo):
         logging.error(f"Project dir not found for {project}")
-        return False
+        return None
+
+    cwd = worktree_path(project, commit_hash)
+    name = os.path.basename(cwd)
+    if os.path.isdir(cwd) and load_built_commits().get(name) == commit_hash:
+        logging.info(f"{project} @ {commit_hash} already built in {cwd}. Reusing.")
+        return cwd
 
     logging.info(f"Checking out {project} @ {commit_hash}...")
-    run_command("git reset --hard", cwd)
-    run_command("git clean -fdx", cwd)
-    
-    if not run_command(f"git checkout -f {commit_hash}", cwd): return False
+    if os.path.isdir(cwd):
+        # Left over from an interrupted build: restore tracked files but keep the
+        # objects so make (and ccache) only redo what is missing
+        run_command(["git", "reset", "--hard"], cwd)
+    elif os.path.isdir(spare_path(project)) and run_command(["git", "worktree", "move", spare_path(project), cwd], repo):
+        # Switching a built tree only rewrites files that differ, so make rebuilds incrementally
+        if not run_command(["git", "checkout", "--force", "--detach", "--no-recurse-submodules", commit_hash], cwd):
+            return None
+    elif not run_command(["git", "worktree", "add", "--force", "--detach", cwd, commit_hash], repo):
+        return None
 
     logging.info("Building (Optimized, No Coverage)...")
     
     if project == "FFmpeg":
-        run_command("./configure --disable-asm --disable-doc", cwd)
+        # FFmpeg's configure ignores $CC, so ccache is passed explicitly
+        cc_flags = ["--cc=ccache gcc", "--cxx=ccache g++"] if USE_CCACHE else []
+        run_command(["./configure", "--disable-asm", "--disable-doc", *cc_flags], cwd)
     elif project == "openssl":
-        run_command("./config", cwd) 
+        run_command(["./config"], cwd)
     elif project == "ImageMagick":
         # Static, Optimized (-O2), No Coverage flags for accurate energy
-        flags = "--disable-shared --enable-static --without-magick-plus-plus --without-perl --without-x CFLAGS='-O2'"
-        run_command(f"./configure {flags}", cwd)
+        flags = ["--disable-shared", "--enable-static", "--without-magick-plus-plus", "--without-perl", "--without-x", "CFLAGS=-O2"]
+        run_command(["./configure", *flags], cwd)
 
-    if not run_command("make -j$(nproc)", cwd): 
+    if not run_command(["make", f"-j{os.cpu_count()}"], cwd): 
         logging.error("Build Failed")
-        return False
+        return None
     
-    return True
+    save_built_commits(lambda built: built.__setitem__(name, commit_hash))
+    return cwd
+
+def remove_worktree(project, commit_hash):
+    cwd = worktree_path(project, commit_hash)
+    save_built_commits(lambda built: built.pop(os.path.basename(cwd), None))
+    spare = spare_path(project)
+    if not os.path.isdir(spare) and run_command(["git", "worktree", "move", cwd, spare], PROJECT_DIR_MAP[project]):
+        return
+    run_command(["git", "worktree", "remove", "--force", cwd], PROJECT_DIR_MAP[project])
 
 def measure_single_test(project, test_name, cwd):
     cmd = get_test_command(project, test_name, cwd)
     
-    # 1. Warmup
-    start_time = time.time()
-    if not run_command(cmd, cwd, ignore_errors=True):
+    # One discarded run warms the page cache and dynamic loader so the ramp-up
+    # below is not sized from a cold start; a failing test stops here
+    if not run_command(f"{cmd} >/dev/null", cwd):
         logging.error(f"Test {test_name} failed to run.")
         return None
-    duration = time.time() - start_time
-    
-    if duration < 0.001: duration = 0.001
-    
-    # 2. Iterations
-    iterations = math.ceil(TARGET_DURATION_SEC / duration)
-    
-    # 3. Perf
-    loop_cmd = f"for i in $(seq 1 {iterations}); do {cmd} >/dev/null 2>&1; done"
-    perf_cmd = f"perf stat -a -e {EVENT_PKG},{EVENT_CORE},cycles,instructions -x, sh -c '{loop_cmd}'"
-    
-    result = subprocess.run(perf_cmd, cwd=cwd, shell=True, stderr=subprocess.PIPE, text=True)
+
+    # Geometric ramp-up: double the iteration count until one measured run
+    # covers at least half of TARGET_DURATION_SEC, capped at MAX_ITERATIONS
+    iterations = 1
+    while True:
+        start_time = time.perf_counter()
+        metrics = measure_iterations(cmd, cwd, iterations)
+        elapsed = time.perf_counter() - start_time
+        if metrics is None:
+            logging.error(f"Test {test_name} failed to run.")
+            return None
+        if elapsed >= TARGET_DURATION_SEC / 2 or iterations >= MAX_ITERATIONS:
+            return metrics
+        iterations = min(iterations * 2, MAX_ITERATIONS)
+
+# Measured children write nowhere
+DEVNULL_ACTIONS = [(os.POSIX_SPAWN_OPEN, 1, os.devnull, os.O_WRONLY, 0),
+                   (os.POSIX_SPAWN_OPEN, 2, os.devnull, os.O_WRONLY, 0)]
+SHELL_METACHARS = set("|&;<>()$`*?[]{}~\n")
+
+def spawn_argv(cmd, cwd):
+    """argv for posix_spawnp that runs cmd inside cwd; the sh changes directory, then execs or runs the compound command."""
+    if SHELL_METACHARS.intersection(cmd): return ["sh", "-c", f"cd {shlex.quote(cwd)} || exit\n{cmd}"]
+    return ["sh", "-c", 'cd "$0" && exec "$@"', cwd] + shlex.split(cmd)
+
+def spawn_iterations(argv, iterations):
+    """Runs argv up to `iterations` times pinned to MEASURE_CPU; stops at and returns the first non-zero exit code (or 0)."""
+    # posix_spawn has no affinity argument; sched_setaffinity(0) only pins the
+    # calling thread, and the children inherit it. The cwd is handled in argv
+    # (spawn_argv), since chdir would move every thread of the process.
+    prev_affinity = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, {MEASURE_CPU})
+    try:
+        for _ in range(iterations):
+            pid = os.posix_spawnp(argv[0], argv, os.environ, file_actions=DEVNULL_ACTIONS)
+            _, wstatus = os.waitpid(pid, 0)
+            status = os.waitstatus_to_exitcode(wstatus)
+            if status != 0: return status # The rest would fail the same way
+        return 0
+    finally:
+        os.sched_setaffinity(0, prev_affinity)
+
+def measure_iterations(cmd, cwd, iterations):
+    # Measure (powercap + perf_event_open directly; perf stat only as fallback)
+    rapl = get_rapl_reader()
+    counters = perf_counters_available()
     
     metrics = {"energy_pkg": 0.0, "energy_core": 0.0, "cycles": 0, "instructions": 0, "ipc": 0.0}
+
+    if rapl and counters:
+        argv = spawn_argv(cmd, cwd)
+        sampler = RaplSampler(rapl)
+        sampler.start()
+        # Opened after the sampler thread exists, so only the spawned tests inherit it
+        counters = PerfCounters()
+        try:
+            counters.start()
+            status = spawn_iterations(argv, iterations)
+            metrics["cycles"], metrics["instructions"] = counters.stop()
+        finally:
+            counters.close()
+        sampler.stop()
+        metrics["energy_pkg"], metrics["energy_core"] = sampler.steady_joules()
+        if status != 0:
+            logging.error(f"Test loop failed with exit code {status}: {cmd}")
+            return None
+        return finalize_metrics(metrics, iterations)
+
+    # perf -r runs the test N times itself and reports per-run means
+    events = PMU_EVENTS
+    # PMU-only runs count just MEASURE_CPU; RAPL events are package-scoped and
+    # must be read system-wide, so they switch perf to -a
+    scope = ["-C", str(MEASURE_CPU)]
+    if not rapl:
+        pkg, core = rapl_events()
+        events = f"{pkg},{core},{PMU_EVENTS}"
+        scope = ["-a"]
+    if not PERF:
+        logging.error("perf not found in PATH and direct counters are unavailable.")
+        return None
+    output_flag = "-j" if perf_supports_json() else "-x,"
+    perf_argv = [PERF, "stat", *scope, "-r", str(iterations), "-e", events, output_flag,
+                 "taskset", "-c", str(MEASURE_CPU), "sh", "-c", f"{cmd} >/dev/null 2>&1"]
     
-    if result.returncode != 0:
-        logging.error(f"Perf failed: {result.stderr}")
+    # Stream perf's stderr so memory stays bounded; only a short tail is kept for errors
+    if rapl: before = rapl.read()
+    proc = subprocess.Popen(perf_argv, cwd=cwd, stderr=subprocess.PIPE)
+    tail = collections.deque(maxlen=20)
+    expected = events.count(",") + 1
+    found = set()
+    for line in proc.stderr:
+        event = value = None
+        if line[:1] == b"{":
+            try:
+                record = json.loads(line)
+                event, value = record["event"].encode(), float(record["counter-value"])
+            except (ValueError, KeyError):
+                event = None # "<not supported>" counter values land here
+        elif line[:1].isdigit():
+            m = PERF_LINE_RE.match(line)
+            if m: event, value = m.group(2), float(m.group(1))
+        key = PERF_EVENT_KEYS.get(event)
+        if key:
+            # Summed, so per-PMU lines (cpu_core + cpu_atom) add up to one value
+            metrics[key] += value
+            found.add(event)
+            if len(found) == expected: break # Nothing useful after the last counter
+        elif b"<not supported>" in line:
+            logging.warning(f"perf event not supported: {line.decode(errors='replace').strip()}")
+        else:
+            tail.append(line)
+    returncode = proc.wait()
+    if rapl: after = rapl.read()
+    
+    if returncode != 0:
+        logging.error(f"Perf failed: {b''.join(tail).decode(errors='replace')}")
         return None
 
-    for line in result.stderr.split('\n'):
-        parts = line.split(',')
-        if len(parts) < 3: continue
-        try:
-            val_str = parts[0]
-            if val_str == "<not supported>" or val_str == "": continue
-            val = float(val_str)
-            event = parts[2]
-            
-            if "energy-pkg" in event: metrics["energy_pkg"] = val
-            elif "energy-cores" in event: metrics["energy_core"] = val
-            elif "cycles" in event: metrics["cycles"] += val # Summing hybrid cores
-            elif "instructions" in event: metrics["instructions"] += val
-            
-        except ValueError: continue
+    if rapl:
+        energy_pkg, energy_core = rapl.delta_joules(before, after)
+        metrics["energy_pkg"], metrics["energy_core"] = energy_pkg / iterations, energy_core / iterations
+
+    return finalize_metrics(metrics, 1)
+
+# On hybrid CPUs name the P-core PMU explicitly (MEASURE_CPU is a P-core) so perf
+# prints a single cycles/instructions line instead of cpu_core + cpu_atom
+PMU_EVENTS = ("cpu_core/cycles/,cpu_core/instructions/"
+              if os.path.isdir("/sys/bus/event_source/devices/cpu_core") else "cycles,instructions")
+
+@functools.cache
+def perf_supports_json():
+    """perf stat -j (JSON lines) is only in recent perf; older builds get the -x, CSV path."""
+    res = subprocess.run([PERF, "stat", "-h"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    return "--json-output" in res.stdout
+
+# perf -x, lines: value,unit,event,... ("<not supported>" values never match)
+PERF_LINE_RE = re.compile(rb'^([\d.]+),[^,]*,([^,]+),', re.M)
+PERF_EVENT_KEYS = {
+    b"power/energy-pkg/": "energy_pkg", b"power/energy-pkg": "energy_pkg",
+    b"power/energy-cores/": "energy_core", b"power/energy-cores": "energy_core",
+    b"cycles": "cycles", b"cpu_core/cycles/": "cycles", b"cpu_atom/cycles/": "cycles",
+    b"instructions": "instructions", b"cpu_core/instructions/": "instructions", b"cpu_atom/instructions/": "instructions",
+}
 
+def finalize_metrics(metrics, iterations):
     if iterations > 0:
         final_metrics = {
             "energy_pkg": metrics["energy_pkg"] / iterations,
@@ -259,41 +769,219 @@ def measure_single_test(project, test_name, cwd):
 
     return final_metrics
 
+def measure_commit(project, commit, todos, on_result):
+    """Builds one commit and measures its pending tests, reporting each via on_result(commit, test, metrics)."""
+    print(f"Processing Commit: {commit} ({len(todos)} tests)")
+    
+    cwd = clean_and_checkout(project, commit)
+    if not cwd:
+        logging.error(f"Skipping commit {commit} due to build failure.")
+        return
+
+    all_measured = True
+    for i, test in enumerate(todos):
+        print(f"  Measuring [{i+1}/{len(todos)}]: {test}")
+        metrics = measure_single_test(project, test, cwd)
+        
+        if metrics:
+            on_result(commit, test, metrics)
+        else:
+            all_measured = False
+            logging.warning(f"Failed to measure {test} on {commit}")
+
+    # Keep the built worktree around only if a rerun will need it
+    if all_measured: remove_worktree(project, commit)
+
+# ==========================================
+# PARALLEL PRE-BUILD
+# ==========================================
+PREBUILD_JOBS = 2
+
+def init_build_worker():
+    global SHELL
+    reset_signal_handlers()
+    SHELL = ShellSession()
+
+def prebuild(work):
+    """Builds the given commits' worktrees side by side, one process per commit.
+
+    Builds overlap each other (configure steps are single-threaded) but never a
+    measurement, since a concurrent build would land in the RAPL package counter.
+    measure_commit then finds each worktree already built.
+    """
+    ctx = multiprocessing.get_context("fork")
+    with concurrent.futures.ProcessPoolExecutor(len(work), mp_context=ctx, initializer=init_build_worker) as pool:
+        projects = [project for project, _, _ in work]
+        commits = [commit for _, commit, _ in work]
+        for commit, cwd in zip(commits, pool.map(clean_and_checkout, projects, commits)):
+            if not cwd: logging.error(f"Pre-build failed for {commit}.")
+
+def measure_in_batches(work, on_result):
+    """Pre-builds PREBUILD_JOBS commits, measures and removes them, then refills.
+
+    At most PREBUILD_JOBS built worktrees exist at once, and the first build of
+    each batch picks up the spare worktree the previous batch left behind.
+    """
+    for start in range(0, len(work), PREBUILD_JOBS):
+        batch = work[start:start + PREBUILD_JOBS]
+        if len(batch) > 1: prebuild(batch)
+        for project, commit, todos in batch:
+            measure_commit(project, commit, todos, on_result)
+
+def reset_signal_handlers():
+    # Forked workers must not run the parent's exit handler with their own copy of the cache
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, signal.SIG_DFL)
+
+# ==========================================
+# MULTI-SOCKET WORKERS
+# ==========================================
+def socket_cpus():
+    """Maps physical package id -> CPUs on that package."""
+    sockets = {}
+    for cpu in range(os.cpu_count()):
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/physical_package_id") as f:
+                sockets.setdefault(int(f.read()), set()).add(cpu)
+        except OSError:
+            continue  # Offline CPU
+    return sockets
+
+def package_zones():
+    """Maps physical package id -> its RAPL package zone, matched by the zone's "package-N" name."""
+    zones = {}
+    if not os.path.isdir(POWERCAP_DIR): return zones
+    for entry in sorted(os.listdir(POWERCAP_DIR)):
+        if not entry.startswith("intel-rapl:") or entry.count(":") != 1: continue  # Skip subzones
+        try:
+            with open(os.path.join(POWERCAP_DIR, entry, "name")) as f:
+                name = f.read().strip()
+        except OSError:
+            continue
+        if name.startswith("package-"):
+            zones[int(name[len("package-"):])] = os.path.join(POWERCAP_DIR, entry)
+    return zones
+
+def socket_worker(socket_id, cpus, pkg_zone, work, results):
+    """Measures a share of the projects on one socket, reading only that socket's RAPL package."""
+    global MEASURE_CPU, RAPL_PKG_ZONE, SHELL, _RAPL_READER, _PERF_COUNTERS
+    if MEASURE_CPU not in cpus:
+        MEASURE_CPU = sorted(cpus)[min(2, len(cpus) - 1)]
+    os.sched_setaffinity(0, (cpus - {MEASURE_CPU}) or cpus)
+    reset_signal_handlers()
+    RAPL_PKG_ZONE = pkg_zone
+    SHELL = ShellSession()
+    _RAPL_READER = _PERF_COUNTERS = None
+
+    try:
+        measure_in_batches(work, lambda c, t, m: results.put((c, t, m)))
+    finally:
+        results.put(None)
+
+def run_on_sockets(sockets, zones, work, on_result):
+    """One worker process per socket; every commit builds in its own worktree, so commits are shared out freely."""
+    shares = {sid: [] for sid in sockets}
+    ids = sorted(sockets)
+    for i, item in enumerate(sorted(work, key=lambda w: -len(w[2]))):
+        shares[ids[i % len(ids)]].append(item)
+
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    workers = [ctx.Process(target=socket_worker, args=(sid, sockets[sid], zones[sid], shares[sid], results))
+               for sid in ids if shares[sid]]
+    for w in workers: w.start()
+
+    # The parent stays the only writer of the checkpoint and CSV
+    finished = 0
+    while finished < len(workers):
+        try:
+            item = results.get(timeout=60)
+        except queue.Empty:
+            if not any(w.is_alive() for w in workers): break
+            continue
+        if item is None: finished += 1
+        else: on_result(*item)
+    for w in workers: w.join()
+
 # ==========================================
 # MAIN
 # ==========================================
+def report_measurement_backends():
+    """Probes powercap and perf_event_open once at startup and logs which path measurements take."""
+    rapl, counters = get_rapl_reader(), perf_counters_available()
+    energy = f"powercap ({RAPL_PKG_ZONE})" if rapl else "perf stat RAPL events"
+    pmu = "perf_event_open (per test process)" if counters else "perf stat"
+    logging.info(f"Energy: {energy}; cycles/instructions: {pmu}")
+
+def read_input(path):
+    """Returns (rows, tasks, commit_project): row dicts, commit -> test names, commit -> project."""
+    tasks = collections.defaultdict(set)
+    commit_project = {}
+
+    if PANDAS_AVAILABLE:
+        # Empty cells stay "" (not NaN) so rows match what csv.DictReader gives
+        try:
+            df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        except pd.errors.EmptyDataError:
+            return [], tasks, commit_project
+        for commit_col, test_col in (('vuln_commit', 'v_testname'), ('fix_commit', 'f_testname')):
+            side = df[df[test_col] != ""]
+            for commit, tests in side.groupby(commit_col, sort=False)[test_col]:
+                tasks[commit].update(tests)
+            commit_project.update(zip(side[commit_col], side['project']))
+        return df.to_dict('records'), tasks, commit_project
+
+    with open(path, 'r') as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        if row['v_testname']:
+            tasks[row['vuln_commit']].add(row['v_testname'])
+            commit_project[row['vuln_commit']] = row['project']
+        if row['f_testname']:
+            tasks[row['fix_commit']].add(row['f_testname'])
+            commit_project[row['fix_commit']] = row['project']
+    return rows, tasks, commit_project
+
 def main():
     check_root()
+    prepare_measurement_cpu()
+    report_measurement_backends()
+    if USE_CCACHE:
+        run_command(["ccache", "-M", CCACHE_MAX_SIZE], CACHE_DIR)
 
     if not os.path.exists(INPUT_CSV_PATH):
         print(f"Error: Input CSV {INPUT_CSV_PATH} not found.")
         return
 
-    with open(INPUT_CSV_PATH, 'r') as f:
-        reader = csv.DictReader(f)
-        rows = list(reader)
+    rows, tasks, commit_project = read_input(INPUT_CSV_PATH)
 
     if not rows:
         print("Input CSV is empty.")
         return
 
-    # Build Tasks
-    tasks = {} 
-    for row in rows:
-        if row['v_testname']:
-            c = row['vuln_commit']
-            if c not in tasks: tasks[c] = set()
-            tasks[c].add(row['v_testname'])
-        if row['f_testname']:
-            c = row['fix_commit']
-            if c not in tasks: tasks[c] = set()
-            tasks[c].add(row['f_testname'])
+    # Only this process touches the database; forked workers report through record()
+    db = open_checkpoint()
+    results_cache = load_checkpoint(db)
 
-    results_cache = load_checkpoint()
-    global_test_counter = 0
+    def record(commit, test, metrics):
+        results_cache[commit][test] = metrics
+        save_result(db, commit, test, metrics)
 
+    # Ctrl-C / kill: stop the workers, then emit the CSV from what has been measured so far
+    def on_signal(signum, frame):
+        print(f"Caught signal {signum}. Writing CSV before exit...")
+        for child in multiprocessing.active_children():
+            child.terminate()
+        write_csv_from_cache(rows, results_cache, final=True)
+        sys.exit(128 + signum)
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, on_signal)
+
+    # Pending (project, commit, todos)
+    work = []
     for commit, test_set in tasks.items():
-        project = rows[0]['project'] 
+        project = commit_project[commit]
         cwd = PROJECT_DIR_MAP.get(project)
         if not cwd:
             print(f"Error: Project directory for {project} not found in map.")
@@ -307,28 +995,26 @@ def main():
             print(f"Commit {commit}: All tests cached. Skipping.")
             continue
             
-        print(f"Processing Commit: {commit} ({len(todos)} tests)")
-        
-        if clean_and_checkout(project, commit):
-            for i, test in enumerate(todos):
-                print(f"  Measuring [{i+1}/{len(todos)}]: {test}")
-                metrics = measure_single_test(project, test, cwd)
-                
-                if metrics:
-                    results_cache[commit][test] = metrics
-                    save_checkpoint(results_cache) 
-                    
-                    global_test_counter += 1
-                    if global_test_counter % CSV_WRITE_INTERVAL == 0:
-                        print(f"  [Auto-Save] Writing CSV after {global_test_counter} tests...")
-                        write_csv_from_cache(rows, results_cache)
-                else:
-                    logging.warning(f"Failed to measure {test} on {commit}")
-        else:
-            logging.error(f"Skipping commit {commit} due to build failure.")
+        work.append((project, commit, todos))
+
+    # Sockets only run side by side when each one has its own RAPL package zone
+    sockets = socket_cpus()
+    zones = package_zones()
+    if len(sockets) > 1 and not all(sid in zones for sid in sockets):
+        logging.warning("Not every socket has a RAPL package zone. Measuring on one socket.")
+    if len(sockets) > 1 and len(work) > 1 and all(sid in zones for sid in sockets):
+        print(f"Measuring {len(work)} commits across {len(sockets)} sockets...")
+        run_on_sockets(sockets, zones, work, record)
+    else:
+        measure_in_batches(work, record)
+
+    for project in {project for project, _, _ in work}:
+        run_command(["git", "worktree", "prune"], PROJECT_DIR_MAP[project])
+
+    db.close()
 
     print("Writing Final CSV...")
-    write_csv_from_cache(rows, results_cache)
+    write_csv_from_cache(rows, results_cache, final=True)
     print(f"Done. Measured data saved to: {OUTPUT_CSV_PATH}")
 
 if __name__ == "__main__":
@@ -2,61 +2,157 @@
 
 import pandas as pd
 import os
-from git import Repo, exc
+import json
+import subprocess
+from git import Repo, GitCmdObjectDB, exc
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 # --- Configuration ---
 CSV_FILE = '../inputs/cwe_gist.csv'
 REPO_BASE_PATH = '/home/mwk/UCD/vf_ec/ds_projects/'
+# Resolved parents from earlier runs, keyed "project:fix_commit"
+PARENT_CACHE_FILE = os.path.join(os.path.dirname(CSV_FILE), '.parent_cache.json')
+# Lookups block on git subprocesses and the network, so run several at once
+MAX_WORKERS = max(1, 3 * os.cpu_count() // 4)
 
-def get_parent_commit(repo_path, fix_commit_hash):
+# Server replies meaning "won't serve an unadvertised sha" (uploadpack.allowReachableSHA1InWant off)
+UNADVERTISED_SHA_ERRORS = ("couldn't find remote ref", "not our ref")
+
+def get_parent_commit(repo, fix_commit_hash, fetch_state):
     """
-    Finds the first parent of a specific commit hash in a git repo.
-    Strategies:
+    Finds the first parent of a specific commit hash in an opened git repo.
+    Strategies, cheapest first:
     1. Check local.
-    2. Fetch all (update branches).
-    3. Surgical fetch (fetch specific hash directly from origin).
+    2. Surgical fetch (just this hash from origin; a full clone already has
+       its parent, a shallow one gets depth=2 so the parent comes along).
+       Repos that are already partial clones keep fetching without blobs
+       (--filter=blob:none); a filtered fetch would turn a full clone into one.
+    3. Fetch all (update branches), only when the server refuses to serve the
+       hash directly, and at most once per repo (tracked in fetch_state).
     """
+    repo_name = os.path.basename(repo.working_dir)
     try:
-        repo = Repo(repo_path)
-        
         # --- Attempt 1: Local Lookup ---
         try:
-            commit = repo.commit(fix_commit_hash)
+            repo.commit(fix_commit_hash)
         except (ValueError, exc.BadName):
-            # --- Attempt 2: General Fetch ---
-            print(f"  [!] Commit {fix_commit_hash[:7]} missing in {os.path.basename(repo_path)}. Running general fetch...")
+            # --- Attempt 2: Surgical Fetch (Specific Hash) ---
+            print(f"  [!] Commit {fix_commit_hash[:7]} missing in {repo_name}. Trying surgical fetch...")
             try:
-                repo.git.fetch('--all')
-                commit = repo.commit(fix_commit_hash)
-                print(f"  [+] Found after general fetch.")
-            except (ValueError, exc.BadName, exc.GitCommandError):
-                # --- Attempt 3: Surgical Fetch (Specific Hash) ---
-                print(f"  [!] General fetch failed. Trying surgical fetch for {fix_commit_hash[:7]}...")
+                # --depth on a full clone would write .git/shallow and cut its history
+                fetch_opts = {'no_tags': True}
+                if repo.git.rev_parse('--is-shallow-repository') == 'true':
+                    fetch_opts['depth'] = 2
+                # --filter marks origin as a promisor remote for good, so only
+                # reuse it where the repo is a partial clone already
+                with repo.config_reader() as cfg:
+                    if cfg.get_value('remote "origin"', 'promisor', False):
+                        fetch_opts['filter'] = 'blob:none'
+                # Equivalent to: git fetch origin <hash> --no-tags
+                repo.git.fetch('origin', fix_commit_hash, **fetch_opts)
+                repo.commit(fix_commit_hash)
+                print(f"  [+] Found after surgical fetch.")
+            except exc.GitCommandError as e:
+                # --- Attempt 3: General Fetch (once per repo) ---
+                if fetch_state['fetched_all'] or not any(m in str(e.stderr) for m in UNADVERTISED_SHA_ERRORS):
+                    print(f"  [!] CRITICAL: Could not retrieve commit {fix_commit_hash[:7]}. Reason: {e}")
+                    return None
+                print(f"  [!] Server refused the hash. Running general fetch...")
+                fetch_state['fetched_all'] = True
                 try:
-                    # Equivalent to: git fetch origin <hash>
-                    repo.git.fetch('origin', fix_commit_hash)
-                    commit = repo.commit(fix_commit_hash)
-                    print(f"  [+] Found after surgical fetch.")
+                    repo.git.fetch('--all')
+                    repo.commit(fix_commit_hash)
+                    print(f"  [+] Found after general fetch.")
                 except Exception as e:
-                    print(f"  [!] CRITICAL: Could not retrieve commit {fix_commit_hash[:7]} even after surgical fetch. Reason: {e}")
+                    print(f"  [!] CRITICAL: Could not retrieve commit {fix_commit_hash[:7]} even after general fetch. Reason: {e}")
                     return None
 
-        # Check if the commit has parents (initial commits do not)
-        if not commit.parents:
-            return None
-            
         # We take the first parent as the pre-fix (vulnerable) state.
-        parent_hash = commit.parents[0].hexsha
-        return parent_hash
+        # Initial commits have no parent, so fix^ does not resolve.
+        try:
+            return repo.rev_parse(f"{fix_commit_hash}^").hexsha
+        except (ValueError, exc.BadName):
+            return None
         
-    except (exc.NoSuchPathError, exc.InvalidGitRepositoryError):
-        print(f"  [!] Error: Repository not found or invalid at {repo_path}")
-        return None
     except Exception as e:
         print(f"  [!] Error processing commit {fix_commit_hash}: {e}")
         return None
 
+def batch_parents(repo_path, hashes):
+    """
+    Maps each hash to its first parent (None for initial commits) using a single
+    `git cat-file --batch` process. Hashes missing locally are left out.
+    """
+    # cat-file takes revisions on stdin; ^{commit} peels tags to their commit
+    revs = "".join(f"{h}^{{commit}}\n" for h in hashes).encode()
+    out = subprocess.run(['git', '-C', repo_path, 'cat-file', '--batch'],
+                         input=revs, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+
+    parents = {}
+    pos = 0
+    for h in hashes:
+        end = out.find(b'\n', pos)
+        if end < 0: break
+        header = out[pos:end].split()
+        pos = end + 1
+        # Found: "<sha> commit <size>" + body; otherwise "<rev> missing" / "<rev> ambiguous"
+        if len(header) != 3: continue
+        size = int(header[2])
+        body = out[pos:pos + size]
+        pos += size + 1
+
+        parent = None
+        for line in body.split(b'\n'):
+            if not line: break  # End of the commit headers
+            if line.startswith(b'parent '):
+                parent = line[7:].decode()
+                break
+        parents[h] = parent
+    return parents
+
+def _worker(task):
+    """Pool entry point: resolves all rows of one project under a single Repo opened in this process."""
+    repo_path, rows = task
+    try:
+        # GitCmdObjectDB reads objects through git itself, with no smmap pack-index mapping in each worker
+        repo = Repo(repo_path, odbt=GitCmdObjectDB)
+    except (exc.NoSuchPathError, exc.InvalidGitRepositoryError):
+        print(f"  [!] Error: Repository not found or invalid at {repo_path}")
+        return [(index, None) for index, _ in rows]
+
+    # Everything already in the local object store resolves in one pass;
+    # only the rest takes the fetch path
+    local = batch_parents(repo_path, [fix_commit for _, fix_commit in rows])
+
+    fetch_state = {'fetched_all': False}
+    results = []
+    for index, fix_commit in rows:
+        if fix_commit in local:
+            parent = local[fix_commit]
+        else:
+            parent = get_parent_commit(repo, fix_commit, fetch_state)
+        if not parent:
+            print(f"  [-] Could not identify parent for {os.path.basename(repo_path)} (Fix: {fix_commit[:7]})")
+        results.append((index, parent))
+    return results
+
+def load_parent_cache():
+    if os.path.exists(PARENT_CACHE_FILE):
+        try:
+            with open(PARENT_CACHE_FILE, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print(f"  [!] Ignoring unreadable cache {PARENT_CACHE_FILE}")
+    return {}
+
+def save_parent_cache(cache):
+    # Temp file + rename so an interrupted write never leaves a torn cache
+    tmp = PARENT_CACHE_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp, PARENT_CACHE_FILE)
+
 def main():
     # 1. Load the CSV
     if not os.path.exists(CSV_FILE):
@@ -70,36 +166,60 @@ def main():
     if 'vuln_commit' not in df.columns:
         df['vuln_commit'] = ""
     
-    # 2. Iterate through the rows
-    updates_count = 0
-    
-    print(f"Processing {len(df)} rows against repos in {REPO_BASE_PATH}...\n")
+    # 2. Group rows by project: each repo is opened (and fetched) once.
+    #    Rows already in the parent cache are filled without touching git.
+    #    Names and hashes are stripped in one vectorized pass; rows without a
+    #    project or fix_commit are dropped by a single mask.
+    projects = df['project'].astype('string').str.strip()
+    fixes = df['fix_commit'].astype('string').str.strip()
+    valid = projects.notna() & fixes.notna() & (fixes != "") & (fixes.str.lower() != 'nan')
+    work = pd.DataFrame({'project': projects[valid], 'fix_commit': fixes[valid]})
 
-    for index, row in df.iterrows():
-        project_name = str(row['project']).strip()
-        fix_commit = str(row['fix_commit']).strip()
-        
-        # Skip if fix_commit is missing
-        if not fix_commit or fix_commit.lower() == 'nan':
+    cache = load_parent_cache()
+    results = {}
+    keys = {}
+    rows_by_project = {}
+    for index, project_name, fix_commit in work.itertuples(index=True, name=None):
+        key = f"{project_name}:{fix_commit}"
+        if key in cache:
+            results[index] = cache[key]
             continue
+        keys[index] = key
+        rows_by_project.setdefault(project_name, []).append((index, fix_commit))
 
-        # Construct full path to the local repository
-        repo_full_path = os.path.join(REPO_BASE_PATH, project_name)
+    # Construct full path to the local repository
+    tasks = [(os.path.join(REPO_BASE_PATH, project_name), rows) for project_name, rows in rows_by_project.items()]
 
-        # Get the parent commit
-        parent = get_parent_commit(repo_full_path, fix_commit)
+    print(f"{len(results)} rows filled from {PARENT_CACHE_FILE}.")
+    print(f"Processing {len(keys)} rows from {len(tasks)} repos in {REPO_BASE_PATH}...\n")
 
-        if parent:
-            df.at[index, 'vuln_commit'] = parent
-            updates_count += 1
-        else:
-            print(f"  [-] Could not identify parent for {project_name} (Fix: {fix_commit[:7]})")
+    # 3. One project per worker process, then apply all parents in one assignment
+    if tasks:
+        with ProcessPoolExecutor(max_workers=min(MAX_WORKERS, len(tasks))) as executor:
+            for project_results in executor.map(_worker, tasks):
+                for index, parent in project_results:
+                    if parent:
+                        results[index] = parent
+                        cache[keys[index]] = parent
+        save_parent_cache(cache)
+
+    # Apply only the parents that differ from what the CSV already holds, in one .loc assignment
+    parents = pd.Series(results, dtype=object)
+    df['vuln_commit'] = df['vuln_commit'].astype(object)
+    changed = parents[df.loc[parents.index, 'vuln_commit'] != parents]
+    df.loc[changed.index, 'vuln_commit'] = changed
 
-    # 3. Save the updated CSV
-    print(f"\nProcessing complete. identified {updates_count} vulnerable commits.")
+    # 4. Save the updated CSV
+    print(f"\nProcessing complete. identified {len(results)} vulnerable commits ({len(changed)} changed).")
+    if changed.empty:
+        print(f"No changes; {CSV_FILE} left as is.")
+        return
     print(f"Overwriting {CSV_FILE}...")
     
-    df.to_csv(CSV_FILE, index=False)
+    # Write beside the original and rename over it: an interrupted run never leaves a torn CSV
+    tmp = CSV_FILE + '.tmp'
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, CSV_FILE)
     print("Done.")
 
 if __name__ == "__main__":
@@ -1,18 +1,33 @@
 import pandas as pd
+import os
 import re
-import time
+import functools
+import types
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 # Try importing scraping libraries.
 try:
     import requests
+    from requests.adapters import HTTPAdapter
     from bs4 import BeautifulSoup
     SCRAPING_AVAILABLE = True
 except ImportError:
     SCRAPING_AVAILABLE = False
     print("Warning: 'requests' and 'beautifulsoup4' libraries not found.")
 
-# --- Configuration: Robust Known Categories ---
-KNOWN_CATEGORIES = {
+# Optional Rust-based Excel reader (python-calamine); pandas' openpyxl path is the fallback.
+try:
+    import python_calamine
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
+# Only these input columns are read (matched after strip/lower)
+INPUT_COLUMNS = {'project', 'commit_id', 'cwe', 'project_url'}
+
+# --- Configuration: Robust Known Categories (keys are lowercase) ---
+KNOWN_CATEGORIES = types.MappingProxyType({
     "core": "Core Framework",
     "curl": "Data Transfer",
     "exim": "Mail Server",
@@ -82,7 +97,7 @@ KNOWN_CATEGORIES = {
     "w3m": "Text Browser",
     "wireshark": "Protocol Analyzer",
     "xserver": "Display Server"
-}
+})
 
 # Fallback keywords if a project is NOT in the list above
 CATEGORY_KEYWORDS = [
@@ -91,24 +106,52 @@ CATEGORY_KEYWORDS = [
     "Server", "Client", "Driver", "Firmware", "Bootloader", "Cryptocurrency",
     "Blockchain", "CMS", "Operating System", "Hypervisor"
 ]
+# All keywords in one case-insensitive scan; matches map back to their canonical spelling
+CATEGORY_RE = re.compile('|'.join(map(re.escape, CATEGORY_KEYWORDS)), re.IGNORECASE)
+CATEGORY_BY_LOWER = {keyword.lower(): keyword for keyword in CATEGORY_KEYWORDS}
 
-def get_category(project_name, url):
+# Concurrent page fetches for projects that are not in the known list
+SCRAPE_WORKERS = 6
+SCRAPE_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
+
+GITHUB_API_HEADERS = {'Accept': 'application/vnd.github+json'}
+if os.getenv('GITHUB_TOKEN'):
+    GITHUB_API_HEADERS['Authorization'] = f"Bearer {os.getenv('GITHUB_TOKEN')}"
+
+def match_category(text_content):
+    match = CATEGORY_RE.search(text_content)
+    return CATEGORY_BY_LOWER[match.group(0).lower()] if match else "Software"
+
+def github_description(session, url):
     """
-    Returns the category using the robust known list first, then falls back to web scraping.
+    Repo description from the GitHub REST API (a small JSON reply instead of the
+    HTML page), or None when the URL is not a github.com repo or the call fails.
     """
-    # 1. Check Known List (Exact match or case-insensitive)
-    p_lower = project_name.lower().strip()
-    if p_lower in KNOWN_CATEGORIES:
-        return KNOWN_CATEGORIES[p_lower]
+    parsed = urlparse(url)
+    parts = [p for p in parsed.path.split('/') if p]
+    if parsed.netloc.lower() not in ('github.com', 'www.github.com') or len(parts) < 2:
+        return None
+    owner, repo = parts[0], parts[1].removesuffix('.git')
+    try:
+        response = session.get(f"https://api.github.com/repos/{owner}/{repo}",
+                               headers=GITHUB_API_HEADERS, timeout=3)
+        if response.status_code == 200:
+            return response.json().get('description') or ""
+    except Exception:
+        pass
+    return None
 
-    # 2. If scraping is unavailable or no URL
-    if not SCRAPING_AVAILABLE or not isinstance(url, str) or not url.startswith('http'):
-        return "Unknown"
+def scrape_category(session, url):
+    """
+    Fetches the project page and matches its description against CATEGORY_KEYWORDS.
+    GitHub repos go through the REST API; the HTML page is the fallback.
+    """
+    description = github_description(session, url)
+    if description is not None:
+        return match_category(description)
 
-    # 3. Attempt Web Scraping (Fallback)
     try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
-        response = requests.get(url, headers=headers, timeout=3)
+        response = session.get(url, headers=SCRAPE_HEADERS, timeout=3)
         
         if response.status_code == 200:
             soup = BeautifulSoup(response.text, 'html.parser')
@@ -124,15 +167,49 @@ def get_category(project_name, url):
                     text_content = desc.get_text()
             
             # Check for generic keywords if specific category not found
-            for keyword in CATEGORY_KEYWORDS:
-                if keyword.lower() in text_content.lower():
-                    return keyword
+            return match_category(text_content)
 
     except Exception:
         pass
 
     return "Software"
 
+@functools.lru_cache(maxsize=1)
+def scrape_session():
+    """One keep-alive session shared by all scraping threads, pooled to SCRAPE_WORKERS."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=SCRAPE_WORKERS, pool_maxsize=SCRAPE_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_category(project_name, url):
+    """
+    Returns the category using the robust known list first, then falls back to web scraping.
+    """
+    # Normalized once here so repeat lookups hit the cache regardless of case/spacing
+    return _get_category(project_name.lower().strip(), url)
+
+@functools.lru_cache(maxsize=4096)
+def _get_category(p_lower, url):
+    # 1. Check Known List (keys are already lowercase)
+    if p_lower in KNOWN_CATEGORIES:
+        return KNOWN_CATEGORIES[p_lower]
+
+    # 2. If scraping is unavailable or no URL
+    if not SCRAPING_AVAILABLE or not isinstance(url, str) or not url.startswith('http'):
+        return "Unknown"
+
+    # 3. Attempt Web Scraping (Fallback)
+    return scrape_category(scrape_session(), url)
+
+def get_categories(projects):
+    """
+    Categories for a list of (project_name, url) pairs; web lookups run SCRAPE_WORKERS at a time.
+    """
+    with ThreadPoolExecutor(max_workers=SCRAPE_WORKERS) as executor:
+        return list(executor.map(lambda pu: get_category(*pu), projects))
+
 def generate_cwe_workbook(input_file, output_file):
     # 1. Define the Top-25 CWE list
     top_25_cwes = set([
@@ -146,7 +223,9 @@ def generate_cwe_workbook(input_file, output_file):
 
     try:
         # Load the Input Excel file
-        df = pd.read_excel(input_file)
+        # Unused columns are never materialized; openpyxl is already opened read-only by pandas
+        df = pd.read_excel(input_file, engine='calamine' if CALAMINE_AVAILABLE else 'openpyxl',
+                           usecols=lambda c: str(c).strip().lower() in INPUT_COLUMNS)
         
         # Standardize column names
         df.columns = [c.strip().lower() for c in df.columns]
@@ -165,33 +244,34 @@ def generate_cwe_workbook(input_file, output_file):
         # ==========================================
         # LOGIC FOR SHEET 1
         # ==========================================
-        sheet1_data = []
-        grouped = df.groupby('project')
-
         print("Generating Sheet 1 data...")
-        for project_name, group in grouped:
-            total_cwe_commits = len(group)
-            
-            cwe_counts = group['cwe'].value_counts()
-            unique_cwes_list = [f"{cwe} ({count})" for cwe, count in cwe_counts.items()]
-            unique_cwes_str = ", ".join(unique_cwes_list)
-
-            project_unique_cwes = set(group['cwe'].unique())
-            intersection = project_unique_cwes.intersection(top_25_cwes)
-            covered_top25_list = sorted(list(intersection))
-            covered_top25_str = ", ".join(covered_top25_list)
-
-            total_top25_count = len(covered_top25_list)
-
-            sheet1_data.append({
-                "project": project_name,
-                "total_cwe_commits": total_cwe_commits,
-                "unique_cwes": unique_cwes_str,
-                "covered_top25": covered_top25_str,
-                "total_top25": total_top25_count
-            })
-
-        df_sheet1 = pd.DataFrame(sheet1_data)
+        # Commits per project (rows without a CWE still count) and per (project, cwe)
+        total_cwe_commits = df.groupby('project').size()
+        # sort=False keeps first-appearance order, so tied counts list like value_counts()
+        pair_counts = df.groupby(['project', 'cwe'], sort=False).size().rename('n').reset_index()
+
+        # "CWE-X (n)" pairs, most frequent first within each project (ties in input order)
+        by_count = pair_counts.sort_values(['project', 'n'], ascending=[True, False], kind='stable')
+        labels = by_count['cwe'].astype(str) + " (" + by_count['n'].astype(str) + ")"
+        unique_cwes = labels.groupby(by_count['project']).agg(", ".join)
+
+        # Vectorized top-25 membership (missing CWEs are never members)
+        is_top25 = df['cwe'].isin(top_25_cwes)
+
+        # Top-25 CWEs present in each project, alphabetically
+        top25_pairs = df.loc[is_top25, ['project', 'cwe']].drop_duplicates().sort_values(['project', 'cwe'])
+        covered_top25 = top25_pairs.groupby('project')['cwe'].agg(", ".join)
+        total_top25 = top25_pairs.groupby('project').size()
+
+        projects = total_cwe_commits.index
+        df_sheet1 = pd.DataFrame({
+            "project": projects,
+            "total_cwe_commits": total_cwe_commits.values,
+            "unique_cwes": unique_cwes.reindex(projects, fill_value="").values,
+            "covered_top25": covered_top25.reindex(projects, fill_value="").values,
+            "total_top25": total_top25.reindex(projects, fill_value=0).values
+        })
+        sheet1_data = df_sheet1.to_dict('records')
         df_sheet1 = df_sheet1.sort_values(by='total_top25', ascending=False)
 
         # ==========================================
@@ -199,30 +279,15 @@ def generate_cwe_workbook(input_file, output_file):
         # ==========================================
         print("Generating Sheet 2 data...")
         sorted_top_25_cols = sorted(list(top_25_cwes))
-        sheet2_mapping = {cwe: [] for cwe in sorted_top_25_cols}
-
-        for row in df_sheet1.to_dict('records'):
-            p_name = row['project']
-            p_total_commits = row['total_cwe_commits']
-            p_covered_str = row['covered_top25']
 
-            if not p_covered_str:
-                continue
+        # One "project(total_cwe_commits)" entry per (project, top-25 CWE) pair,
+        # largest projects first in every column
+        top25_entries = top25_pairs.assign(total=top25_pairs['project'].map(total_cwe_commits))
+        top25_entries['entry'] = top25_entries['project'].astype(str) + "(" + top25_entries['total'].astype(str) + ")"
+        top25_entries = top25_entries.sort_values('total', ascending=False, kind='stable')
+        sheet2_mapping = top25_entries.groupby('cwe')['entry'].agg(list).to_dict()
 
-            covered_cwes = [x.strip() for x in p_covered_str.split(',') if x.strip()]
-            entry_str = f"{p_name}({p_total_commits})"
-
-            for cwe in covered_cwes:
-                if cwe in sheet2_mapping:
-                    sheet2_mapping[cwe].append(entry_str)
-
-        for cwe in sheet2_mapping:
-            sheet2_mapping[cwe].sort(
-                key=lambda x: int(re.search(r'\((\d+)\)', x).group(1)), 
-                reverse=True
-            )
-
-        df_sheet2 = pd.DataFrame({k: pd.Series(v) for k, v in sheet2_mapping.items()})
+        df_sheet2 = pd.DataFrame({cwe: pd.Series(sheet2_mapping.get(cwe, []), dtype=object) for cwe in sorted_top_25_cols})
 
         # ==========================================
         # LOGIC FOR SHEET 3 (Updated Category)
@@ -233,26 +298,22 @@ def generate_cwe_workbook(input_file, output_file):
         sheet3_candidates = [row for row in sheet1_data if row['total_cwe_commits'] >= 10]
         sheet3_candidates.sort(key=lambda x: x['total_cwe_commits'], reverse=True)
 
-        for row in sheet3_candidates:
+        # Fetch Categories from robust list (web lookups run concurrently)
+        candidate_urls = [url_lookup.get(row['project'], "") for row in sheet3_candidates]
+        categories = get_categories([(row['project'], url) for row, url in zip(sheet3_candidates, candidate_urls)])
+
+        for row, p_url, category_val in zip(sheet3_candidates, candidate_urls, categories):
             p_name = row['project']
             p_count = row['total_cwe_commits']
-            p_url = url_lookup.get(p_name, "")
             
             project_display = f"{p_name}({p_count})"
             
-            # Fetch Category from robust list
-            category_val = get_category(p_name, p_url)
-            
             sheet3_data.append({
                 "selected_projects": project_display,
                 "found_in_CWEs": row['total_top25'],
                 "category": category_val,
                 "project_url": p_url
             })
-            
-            # Tiny sleep only if we actually hit the web
-            if SCRAPING_AVAILABLE and p_name.lower() not in KNOWN_CATEGORIES and p_url:
-                time.sleep(0.3)
 
         df_sheet3 = pd.DataFrame(sheet3_data)
         
@@ -263,7 +324,9 @@ def generate_cwe_workbook(input_file, output_file):
         # WRITE TO EXCEL
         # ==========================================
         print("Writing to Excel...")
-        with pd.ExcelWriter(output_file) as writer:
+        # xlsxwriter explicitly (set_column below is its API). Not constant_memory:
+        # pandas writes cells column by column, which that mode silently drops
+        with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
             df_sheet1.to_excel(writer, sheet_name='Sheet1', index=False)
             df_sheet2.to_excel(writer, sheet_name='Sheet2', index=False)
             df_sheet3.to_excel(writer, sheet_name='Sheet3', index=False)